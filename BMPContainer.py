@@ -0,0 +1,237 @@
+import io
+import os
+import struct
+import mmap
+from contextlib import contextmanager
+import numpy as np
+
+# Способы сжатия BMP, при которых пиксели хранятся без сжатия
+BI_RGB = 0
+BI_BITFIELDS = 3
+BI_ALPHABITFIELDS = 6
+
+# Сколько байтов читать для разбора заголовков (BITMAPFILEHEADER + BITMAPV5HEADER)
+HEADER_READ_SIZE = 14 + 124
+
+
+class BMPContainer:
+    """
+    BMP-контейнер: заголовок разбирается один раз, а пиксельные данные доступны
+    как NumPy-представление (view) файла без копирования.
+
+    Носителями считаются только байты пикселей: заголовки, палитра и
+    выравнивание строк до 4 байт в них не входят. Носители нумеруются
+    подряд в порядке хранения строк в файле.
+
+    Вместо пути можно передать изображение в памяти: bytes-like объект
+    (bytes, bytearray, memoryview, mmap) или файлоподобный объект с методом read.
+    Изменяемый буфер используется без копирования, и embed изменяет его на месте;
+    неизменяемый (bytes) копируется только перед первой записью в носители.
+
+    Файл по пути без use_mmap читается целиком только при первом обращении к
+    пикселям: для потокового внедрения (embed_stream) достаточно заголовка.
+    """
+    def __init__(self, input_file, use_mmap=False):
+        # Путь к файлу (None, если изображение передано в памяти)
+        self.input_file = None
+        self._data = None
+        self._pixels = None
+
+        if isinstance(input_file, (str, os.PathLike)):
+            self.input_file = input_file
+            with open(input_file, 'rb') as f:
+                if use_mmap:
+                    # Файл отображается в память (copy-on-write): с диска читаются только
+                    # затронутые страницы, а изменения при embed не попадают в исходный файл
+                    self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                else:
+                    # Пока читаем только заголовки, пиксели - при первом обращении (см. data)
+                    self._parse_header(f.read(HEADER_READ_SIZE), os.fstat(f.fileno()).st_size)
+                    self.readonly = False
+                    return
+        elif hasattr(input_file, 'read'):
+            self.data = input_file.read()
+        else:
+            self.data = input_file
+
+        view = memoryview(self.data)
+        if view.ndim != 1 or view.itemsize != 1:
+            # Многомерные и не байтовые буферы рассматриваем как плоские байты
+            self.data = view.cast('B')
+        self.readonly = view.readonly
+
+        self._parse_header(self.data, len(self.data))
+
+    @property
+    def data(self):
+        """
+        Содержимое файла (вместе с заголовками); файл по пути читается при первом обращении
+        """
+        if self._data is None and self.input_file is not None:
+            with open(self.input_file, 'rb') as f:
+                self._data = bytearray(f.read())
+            if len(self._data) != self.size:
+                raise ValueError("BMP-файл изменился после разбора заголовка")
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._pixels = None
+
+    @property
+    def pixels(self):
+        """
+        Представление пикселей (height, row_bytes) без копирования и без выравнивания строк
+        """
+        if self._pixels is None:
+            self._pixels = np.frombuffer(self.data, dtype=np.uint8, count=self.stride * self.height,
+                                         offset=self.offset).reshape(self.height, self.stride)[:, :self.row_bytes]
+        return self._pixels
+
+    def _parse_header(self, header, size):
+        """
+        Разбор BITMAPFILEHEADER и заголовка изображения (CORE, INFO, V4, V5)
+
+        :param header: начало файла (не меньше заголовков)
+        :param size: полный размер файла в байтах
+        """
+        self.size = size
+
+        # Проверка формата файла
+        if len(header) < 26 or header[0] != ord('B') or header[1] != ord('M'):
+            raise ValueError("Файл не является BMP-форматом")
+
+        self.offset = struct.unpack_from('<I', header, 10)[0]  # bfOffBits
+        dib_size = struct.unpack_from('<I', header, 14)[0]
+
+        if dib_size == 12:
+            # BITMAPCOREHEADER
+            self.width, self.height, _, self.bits_per_pixel = struct.unpack_from('<HHHH', header, 18)
+            compression = BI_RGB
+        elif dib_size >= 40 and len(header) >= 14 + 40:
+            self.width, self.height, _, self.bits_per_pixel, compression = struct.unpack_from('<iiHHI', header, 18)
+        else:
+            raise ValueError(f"Неподдерживаемый заголовок BMP (размер {dib_size})")
+
+        if compression not in (BI_RGB, BI_BITFIELDS, BI_ALPHABITFIELDS):
+            raise ValueError("Сжатые BMP-файлы не поддерживаются")
+
+        # Отрицательная высота означает, что строки хранятся сверху вниз
+        self.top_down = self.height < 0
+        self.height = abs(self.height)
+
+        # Полезные байты строки и шаг строки с учётом выравнивания до 4 байт
+        self.row_bytes = (self.width * self.bits_per_pixel + 7) // 8
+        self.stride = (self.width * self.bits_per_pixel + 31) // 32 * 4
+
+        if self.offset + self.stride * self.height > size:
+            raise ValueError("Повреждённый BMP-файл: пиксельные данные обрезаны")
+
+        # Если выравнивания нет, носители лежат в файле подряд
+        self.contiguous = self.row_bytes == self.stride
+        self.image_size = self.height * self.row_bytes
+
+    def close(self):
+        """
+        Освобождение отображения файла в память (для use_mmap=True)
+        """
+        self._pixels = None
+        if isinstance(self._data, mmap.mmap):
+            try:
+                self._data.close()
+            except BufferError:
+                # На отображение ещё ссылаются массивы из take() или memoryview из embed:
+                # оно будет освобождено вместе с последним из них
+                pass
+
+    def _make_writable(self):
+        """
+        Копия неизменяемого буфера перед первой записью в носители
+        """
+        if self.readonly:
+            self.data = bytearray(self.data)
+            self.readonly = False
+
+    def buffer(self):
+        """
+        Содержимое контейнера (вместе со всеми заголовками) без копирования
+        """
+        return memoryview(self.data)
+
+    def open(self):
+        """
+        Файловый объект для последовательного чтения исходного контейнера
+        """
+        if self.input_file is not None:
+            return open(self.input_file, 'rb')
+        return io.BytesIO(self.data)
+
+    def _flat_index(self, start, stop, step):
+        """
+        Номера носителей [start:stop:step] -> индексы (строка, столбец) в self.pixels
+        """
+        index = np.arange(*slice(start, stop, step).indices(self.image_size))
+        return np.divmod(index, self.row_bytes)
+
+    def take(self, start=0, stop=None, step=1):
+        """
+        Носители [start:stop:step]: представление без копирования, если строки
+        не выровнены, иначе копия только запрошенных байтов
+        """
+        if self.contiguous:
+            return self.pixels.reshape(-1)[start:stop:step]
+        return self.pixels[self._flat_index(start, stop, step)]
+
+    def put(self, values, start=0, stop=None, step=1):
+        """
+        Запись носителей [start:stop:step], полученных через take()
+        """
+        self._make_writable()
+        if self.contiguous:
+            flat = self.pixels.reshape(-1)[start:stop:step]
+            if not np.shares_memory(flat, values):
+                flat[:] = values
+        else:
+            self.pixels[self._flat_index(start, stop, step)] = values
+
+    def take_index(self, index):
+        """
+        Носители с номерами index (копия, порядок - как в index)
+        """
+        if self.contiguous:
+            return self.pixels.reshape(-1)[index]
+        return self.pixels[np.divmod(index, self.row_bytes)]
+
+    def put_index(self, values, index):
+        """
+        Запись носителей с номерами index, полученных через take_index()
+        """
+        self._make_writable()
+        if self.contiguous:
+            self.pixels.reshape(-1)[index] = values
+        else:
+            self.pixels[np.divmod(index, self.row_bytes)] = values
+
+    @contextmanager
+    def carriers(self, start=0, stop=None):
+        """
+        Изменяемый плоский массив носителей [start:stop]; при выравнивании строк
+        изменения записываются обратно при выходе из блока with
+        """
+        self._make_writable()
+        pixels = self.take(start, stop)
+        yield pixels
+        self.put(pixels, start, stop)
+
+    def save(self, output_file):
+        """
+        Сохранение контейнера (вместе со всеми заголовками) в файл
+
+        :param output_file: путь или файлоподобный объект с методом write
+        """
+        if hasattr(output_file, 'write'):
+            output_file.write(self.data)
+            return
+        with open(output_file, 'wb') as f:
+            f.write(self.data)
@@ -1,139 +1,432 @@
-import struct
 import math
+import os
+import zlib
 import numpy as np
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from BMPContainer import BMPContainer
+from instrumentation import instrument
+from streaming import DEFAULT_CHUNK_SIZE, stream_embed
+import frame
+import codec
+
+# Минимальный размер шарда (в блоках), который имеет смысл отдавать отдельному потоку
+SHARD_MIN_BLOCKS = 1 << 16
+
+# Допустимые параметры k для кодов (2^k - 1, k)
+MIN_K = 2
+MAX_K = 8
+# Старый формат без кадра: длина (32 бита) кодируется k = 4 и занимает 8 блоков по 15 пикселей,
+# старшие 4 бита длины хранят k (0 означает k = 4)
+HEADER_K = 4
+HEADER_PIXELS = 32 // HEADER_K * (2 ** HEADER_K - 1)
+MAX_MESSAGE_LENGTH = (1 << 28) - 1
+
+
+@lru_cache(maxsize=None)
+def hamming_code(k):
+    """
+    Проверочная матрица и таблицы для кода Хемминга с длиной блока n = 2^k - 1
+    (строятся один раз для каждого k)
+    
+    :return: (H, columns, flip_table), где columns[j] - столбец j матрицы H как k-битное
+             число, а flip_table[s] - позиция в блоке, которую нужно инвертировать,
+             чтобы получить синдром s (-1 - ничего не меняем)
+    """
+    if not MIN_K <= k <= MAX_K:
+        raise ValueError(f"k должно быть в диапазоне {MIN_K}..{MAX_K}")
+    n = 2 ** k - 1
+    
+    # Столбец j матрицы H - двоичная запись числа j + 1 (строка r - разряд r)
+    columns = np.arange(1, n + 1, dtype=np.uint8)
+    H = (columns[None, :] >> np.arange(k)[:, None]) & 1
+    
+    flip_table = np.full(n + 1, -1, dtype=np.int64)
+    flip_table[columns] = np.arange(n)
+    
+    for table in (H, columns, flip_table):
+        table.setflags(write=False)
+    return H, columns, flip_table
+
+
+def syndromes(pixels, k):
+    """
+    Синдромы блоков pixels: матрица (N, 2^k - 1) младших битов, по строке на блок
+    """
+    columns = hamming_code(k)[1]
+    C = pixels.reshape(-1, len(columns)) & 1
+    return np.bitwise_xor.reduce(C * columns, axis=1)
+
+
+def map_shards(func, n_blocks, workers):
+    """
+    Вызов func(start, stop) для непересекающихся диапазонов блоков, возвращает
+    список результатов. При workers > 1 диапазоны обрабатываются в пуле потоков:
+    NumPy отпускает GIL, а шарды пишут в разные части одного буфера
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    shards = min(workers, -(-n_blocks // SHARD_MIN_BLOCKS))
+    if shards <= 1:
+        return [func(0, n_blocks)]
+    
+    bounds = np.linspace(0, n_blocks, shards + 1).astype(np.int64)
+    with ThreadPoolExecutor(max_workers=shards) as pool:
+        return list(pool.map(func, bounds[:-1], bounds[1:]))
+
+
+def decode_blocks(container, start, stop, k, workers=1):
+    """
+    Декодирование блоков кода k в носителях [start, stop) контейнера BMPContainer:
+    k битов сообщения из каждого блока
+    """
+    n = 2 ** k - 1
+    pixels = container.take(start, stop)
+    pixels = pixels[:len(pixels) // n * n]
+    s = np.empty(len(pixels) // n, dtype=np.uint8)
+    
+    def decode(a, b):
+        s[a:b] = syndromes(pixels[a * n:b * n], k)
+    map_shards(decode, len(s), workers)
+    
+    # Раскладываем синдромы на биты (младший разряд - первый бит группы)
+    return ((s[:, None] >> np.arange(k, dtype=np.uint8)) & 1).reshape(-1)
+
+
+def capacity(image_size, k):
+    """
+    Максимальная длина сообщения (в байтах) для кода k в изображении из image_size носителей;
+    -1, если k вне диапазона или в изображении не помещается даже область кадра
+    """
+    if not MIN_K <= k <= MAX_K or image_size < frame.payload_offset(2 ** k - 1):
+        return -1
+    blocks = (image_size - frame.payload_offset(2 ** k - 1)) // (2 ** k - 1)
+    return blocks * k // 8
+
+
+def fits(image_size, k, message_length):
+    """
+    Помещается ли сообщение длины message_length, внедрённое кодом k после кадра
+    """
+    return message_length <= capacity(image_size, k)
+
+
+def legacy_offset(k):
+    """
+    Номер носителя, с которого начинается сообщение старого формата для кода k
+    """
+    n = 2 ** k - 1
+    return -(-HEADER_PIXELS // n) * n
+
+
+def read_legacy_header(container):
+    """
+    Длина сообщения и k из старого заголовка: 32 бита, закодированные k = 4,
+    в старших 4 битах - k (0 означает k = 4)
+
+    :return: (k, длина) или None, если изображение меньше заголовка
+    """
+    if container.image_size < HEADER_PIXELS:
+        return None
+    value = int.from_bytes(np.packbits(decode_blocks(container, 0, HEADER_PIXELS, HEADER_K)).tobytes(), 'big')
+    return value >> 28 or HEADER_K, value & MAX_MESSAGE_LENGTH
+
+
+def legacy_fits(image_size, k, message_length):
+    """
+    Помещается ли сообщение из старого заголовка в изображение
+    """
+    if not MIN_K <= k <= MAX_K:
+        return False
+    n = 2 ** k - 1
+    return legacy_offset(k) + -(-message_length * 8 // k) * n <= image_size
+
 
 class HammingStego:
-    def __init__(self, input_file):
+    def __init__(self, input_file, use_mmap=False, metrics=None, cache=None):
+        """
+        :param input_file: путь к BMP-файлу, bytes-like объект или файлоподобный объект
+                           (изменяемый буфер используется без копирования, embed изменяет его)
+        :param use_mmap: отобразить файл в память вместо чтения целиком
+        :param metrics: получатель замеров (функция metrics(event) или MetricsCollector)
+        :param cache: CoverCache - брать разобранный контейнер из кэша; каждое внедрение
+                      тогда получает свою копию, и объект можно использовать повторно
+        """
         self.input_file = input_file
-        self.header_size = 54  # Размер заголовка BMP для 24-битных изображений
-        
-        # Проверочная матрица H для (15,11)-кода Хемминга
-        self.H = np.array([
-            [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1],
-            [0, 1, 1, 0, 0, 1, 1, 0, 0, 1, 1, 0, 0, 1, 1],
-            [0, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0, 1, 1, 1, 1],
-            [0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1]
-        ])
+        self.metrics = metrics
         
-        # Чтение файла
-        with open(input_file, 'rb') as f:
-            self.data = bytearray(f.read())
+        # Проверочная матрица H для (15,11)-кода Хемминга (k = 4):
+        # [[1 0 1 0 1 0 1 0 1 0 1 0 1 0 1]
+        #  [0 1 1 0 0 1 1 0 0 1 1 0 0 1 1]
+        #  [0 0 0 1 1 1 1 0 0 0 0 1 1 1 1]
+        #  [0 0 0 0 0 0 0 1 1 1 1 1 1 1 1]]
+        self.H = hamming_code(HEADER_K)[0]
+        # Код, которым внедрено (извлечено) последнее сообщение
+        self.k = None
         
-        # Проверка формата файла
-        if self.data[0] != ord('B') or self.data[1] != ord('M'):
-            raise ValueError("Файл не является BMP-форматом")
+        # Разбор BMP-заголовка; пиксели доступны через container без копирования
+        inst = instrument(metrics, 'hamming', 'load')
+        with inst.phase('load'):
+            # Запись кэша (None без кэша) и рабочий контейнер
+            self.cover = cache.get(input_file) if cache is not None else None
+            self.container = self.cover.checkout() if self.cover is not None else BMPContainer(input_file, use_mmap)
         
-        self.image_size = len(self.data) - self.header_size
+        # Размер изображения в байтах-носителях (без заголовков и выравнивания строк)
+        self.image_size = self.container.image_size
+        inst.count(image_size=self.image_size)
+        inst.finish()
+    
+    @property
+    def data(self):
+        """
+        Содержимое BMP-файла (вместе с заголовками)
+        """
+        return self.container.data
+    
+    def close(self):
+        """
+        Освобождение отображения файла в память (для use_mmap=True)
+        """
+        self.container.close()
     
-    def embed(self, message, output_file):
+    def _checkout(self):
+        """
+        Новая копия-при-записи контейнера из кэша для каждого внедрения (без кэша - ничего)
         """
-        Внедрение сообщения с использованием (15,11)-кода Хемминга
+        if self.cover is not None:
+            self.container = self.cover.checkout()
+    
+    def payload_offset(self, k):
         """
+        Номер носителя, с которого начинается сообщение для кода k
+        (область кадра округляется до целого числа блоков кода k)
+        """
+        return frame.payload_offset(2 ** k - 1)
+    
+    def capacity(self, k=None):
+        """
+        Максимальная длина сообщения (в байтах) для кода k (None - наибольшая по всем k)
+        """
+        if k is None:
+            return max(capacity(self.image_size, k) for k in range(MIN_K, MAX_K + 1))
+        return capacity(self.image_size, k)
+    
+    def choose_k(self, message_length):
+        """
+        Выбор k для сообщения длины message_length: среди кодов, для которых сообщение
+        помещается, берётся наибольший k - у него меньше всего изменений на бит,
+        (1 - 2^-k) / k
+        """
+        for k in range(MAX_K, MIN_K - 1, -1):
+            if message_length <= self.capacity(k):
+                return k
+        return None
+    
+    def embed(self, message, output_file=None, k=None, workers=1, compress=None):
+        """
+        Внедрение сообщения с использованием (2^k - 1, k)-кода Хемминга
+        
+        :param message: строка или байты для внедрения
+        :param output_file: имя выходного файла или файлоподобный объект;
+                            None - вернуть результат в памяти
+        :param k: параметр кода (2..8); None - выбрать автоматически
+        :param workers: число потоков для параллельной обработки блоков (None - по числу ядер)
+        :param compress: сжать сообщение перед внедрением: 'auto' (самый короткий из zlib,
+                         lzma, bz2; без сжатия, если оно не помогает), 'zlib', 'lzma', 'bz2'
+                         или None - без сжатия; extract распаковывает автоматически
+        :return: при output_file=None - memoryview изображения со встроенным сообщением
+                 (без копирования; действителен, пока жив объект)
+        """
+        inst = instrument(self.metrics, 'hamming', 'embed')
+        self._checkout()
+        
         if isinstance(message, str):
             message = message.encode('utf-8')
         
-        # Добавляем длину сообщения (4 байта)
+        # Сжатие до выбора k: короткому сообщению подходит код с меньшим числом изменений
+        with inst.phase('compress'):
+            raw_length = len(message)
+            message, codec_id = codec.compress(message, compress)
+        
         message_length = len(message)
-        message = struct.pack('>I', message_length) + message
+        if k is None:
+            k = self.choose_k(message_length)
+        
+        # Проверяем, достаточно ли места в изображении
+        if k is None or message_length > self.capacity(k):
+            raise ValueError(f"Сообщение слишком большое для изображения. Нужно {message_length} байт, доступно {max(self.capacity(k), 0)}")
         
         # Преобразуем сообщение в биты
-        bits = []
-        for byte in message:
-            bits.extend([(byte >> i) & 1 for i in range(7, -1, -1)])
+        with inst.phase('pack'):
+            bits = np.unpackbits(np.frombuffer(message, dtype=np.uint8))
+        offset = self.payload_offset(k)
+        total_pixels_needed = offset + -(-len(bits) // k) * (2 ** k - 1)
         
-        # Группируем биты по 4 (так как мы кодируем 4 бита в 15 пикселей)
-        bit_groups = [bits[i:i+4] for i in range(0, len(bits), 4)]
+        with inst.phase('embed'):
+            with self.container.carriers(0, total_pixels_needed) as pixels:
+                # Кадр (метод, k, длина, CRC) - в LSB первых носителей, сообщение - блоками кода k
+                header = frame.pack_frame(frame.METHOD_HAMMING, k, message_length, zlib.crc32(message),
+                                          codec.to_flags(codec_id))
+                flipped = self._embed_header(pixels[:frame.FRAME_BITS], header)
+                flipped += self._embed_bits(pixels[offset:], bits, k, workers, self._cover_syndromes(k))
+        self.k = k
         
-        # Проверяем, достаточно ли места в изображении
-        total_pixels_needed = len(bit_groups) * 15
-        available_pixels = self.image_size
+        # Сохранение результата (в памяти результат возвращается без копирования)
+        if output_file is not None:
+            with inst.phase('write'):
+                self.container.save(output_file)
         
-        if total_pixels_needed > available_pixels:
-            raise ValueError(f"Сообщение слишком большое для изображения. Нужно {total_pixels_needed} пикселей, доступно {available_pixels}")
+        inst.count(k=k, carriers_touched=total_pixels_needed, bits_embedded=frame.FRAME_BITS + len(bits), bits_flipped=flipped,
+                   message_length=raw_length, payload_length=message_length)
+        inst.finish()
         
-        # Индекс текущей позиции в данных изображения
-        data_index = self.header_size
+        if output_file is None:
+            return self.container.buffer()
+    
+    def embed_stream(self, source, output_file, k=HEADER_K, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        """
+        Потоковое внедрение кодом Хемминга: контейнер читается и записывается
+        кусками (кратными длине блока), поэтому в памяти никогда не находится целиком
+        (объект, созданный по пути, читает из файла только заголовки)
         
-        for group in bit_groups:
-            if len(group) < 4:
-                # Дополняем последнюю группу нулями, если нужно
-                group += [0] * (4 - len(group))
-            
-            # Получаем младшие биты следующих 15 пикселей
-            C = []
-            for i in range(15):
-                if data_index + i < len(self.data):
-                    C.append(self.data[data_index + i] & 1)
-                else:
-                    C.append(0)  # Если вышли за пределы - добавляем 0
-            
-            # Вычисляем синдром
-            m_vec = np.array(group, dtype=np.uint8).reshape(4, 1)
-            C_vec = np.array(C, dtype=np.uint8).reshape(15, 1)
-            # print((self.H @ C_vec))
-            s = (self.H @ C_vec) % 2
-            # print(s)
-            # print(m_vec)
-            s = s ^ m_vec  # XOR между синдромом и сообщением
-            # print(s)
-            
-            # Вычисляем позицию для изменения (преобразуем биты в число)
-            i = int(s[3] * 8 + s[2] * 4 + s[1] * 2 + s[0])
-
-            # Модифицируем i-й бит (если i != 0 и в пределах массива)
-            if 0 < i <= 15 and (data_index + i - 1) < len(self.data):
-                self.data[data_index + i - 1] ^= 1  # Инвертируем LSB
-            
-            # Переходим к следующей группе пикселей
-            data_index += 15
+        :param source: строка, байты, файлоподобный объект или итерируемый объект с кусками байтов
+        :param output_file: имя выходного файла или файлоподобный объект (с seek)
+        :param k: параметр кода (2..8); длина сообщения заранее неизвестна, поэтому
+                  автоматический выбор не поддерживается
+        :param chunk_size: размер читаемого куска в байтах
+        :param workers: число потоков для параллельной обработки блоков куска
+        """
+        inst = instrument(self.metrics, 'hamming', 'embed_stream')
+        self._checkout()
+        n = 2 ** k - 1
+        offset = self.payload_offset(k)
+        
+        def embed_header(pixels, payload):
+            header = frame.pack_frame(frame.METHOD_HAMMING, k, payload.length, payload.crc)
+            self._embed_header(pixels, header)
+        
+        with inst.phase('stream'):
+            stream_embed(self.container, output_file, source, n, k, max((self.image_size - offset) // n, 0),
+                         lambda pixels, bits: self._embed_bits(pixels, bits, k, workers),
+                         offset, embed_header, chunk_size)
+        self.k = k
+        inst.count(k=k)
+        inst.finish()
+    
+    def _embed_header(self, pixels, header):
+        """
+        Запись битов кадра в LSB первых FRAME_BITS носителей (заменой, как в LSB-R:
+        кадр читается одинаково для всех методов), возвращает число изменённых битов
+        """
+        carriers = pixels[:len(header)]
+        flipped = int(np.count_nonzero((carriers & 1) != header))
+        carriers &= 0xFE
+        carriers |= header
+        return flipped
+    
+    def _cover_syndromes(self, k):
+        """
+        Синдромы всех блоков кода k после области кадра из кэша контейнеров
+        (None, если объект создан без кэша)
+        """
+        if self.cover is None:
+            return None
+        
+        def compute():
+            n = 2 ** k - 1
+            offset = self.payload_offset(k)
+            blocks = max((self.image_size - offset) // n, 0)
+            return syndromes(self.cover.container.take(offset, offset + blocks * n), k)
+        return self.cover.derive(('syndromes', k), compute)
+    
+    def _embed_bits(self, pixels, bits, k=HEADER_K, workers=1, syndromes=None):
+        """
+        Внедрение битов bits в первые блоки по 2^k - 1 пикселей из pixels,
+        возвращает число инвертированных битов
+        
+        :param syndromes: синдромы блоков pixels, вычисленные заранее (None - вычислить)
+        """
+        n = 2 ** k - 1
+        
+        # Группируем биты по k (так как мы кодируем k битов в n пикселей),
+        # последнюю группу дополняем нулями
+        bit_groups = np.zeros((-(-len(bits) // k), k), dtype=np.uint8)
+        bit_groups.reshape(-1)[:len(bits)] = bits
         
-        # Сохранение результата
-        with open(output_file, 'wb') as f:
-            f.write(self.data)
+        # Группа битов сообщения как k-битное число (первый бит - младший разряд синдрома)
+        m = bit_groups @ (1 << np.arange(k, dtype=np.uint8))
+        
+        # Блоки независимы, поэтому шарды обрабатываются параллельно над общим буфером
+        pixels = pixels[:len(m) * n]
+        return sum(map_shards(lambda start, stop: self._embed_blocks(
+            pixels[start * n:stop * n], m[start:stop], k,
+            syndromes[start:stop] if syndromes is not None else None), len(m), workers))
+    
+    def _embed_blocks(self, pixels, m, k, s=None):
+        """
+        Внедрение k-битных значений m в блоки pixels (по одному значению на блок),
+        возвращает число инвертированных битов
+        """
+        n = 2 ** k - 1
+        
+        # Синдромы всех блоков сразу, XOR с сообщением и позиция для изменения по таблице
+        if s is None:
+            s = syndromes(pixels, k)
+        positions = hamming_code(k)[2][s ^ m]
+        
+        # Инвертируем LSB во всех блоках одним scatter-присваиванием
+        blocks = np.flatnonzero(positions >= 0)
+        pixels[blocks * n + positions[blocks]] ^= 1
+        return len(blocks)
     
-    def extract(self):
+    def extract(self, workers=1, legacy=None):
         """
         Извлечение сообщения, закодированного с помощью кода Хемминга
+        (k и длина определяются по кадру)
+        
+        :param workers: число потоков для параллельного декодирования блоков (None - по числу ядер)
+        :param legacy: как поступать с файлом без кадра: None - читать сообщение в старом формате
+                       (длина, закодированная k = 4), если длина из старого заголовка помещается
+                       в изображение, иначе вернуть b''; True - читать в старом формате всегда;
+                       False - сразу вернуть b''
         """
-        bits = []
-        data_index = self.header_size
+        inst = instrument(self.metrics, 'hamming', 'extract')
+        message_bits = np.zeros(0, dtype=np.uint8)
+        carriers_touched = frame.FRAME_BITS
         
-        # Читаем данные, пока не кончится изображение
-        while data_index + 15 <= len(self.data):
-            # Получаем младшие биты следующих 15 пикселей
-            C = []
-            for i in range(15):
-                C.append(self.data[data_index + i] & 1)
-            
-            # Вычисляем извлеченное сообщение (4 бита)
-            C_vec = np.array(C, dtype=np.uint8).reshape(15, 1)
-            m = (self.H @ C_vec) % 2
-            
-            # Добавляем извлеченные 4 бита
-            bits.extend(m.flatten().tolist()[:4])
+        with inst.phase('extract'):
+            header = frame.read_frame(self.container)
+            if header is not None:
+                if header.method != frame.METHOD_HAMMING:
+                    raise ValueError("Сообщение внедрено другим методом")
+                k, message_length = header.param, header.length
+                if not fits(self.image_size, k, message_length):
+                    raise ValueError("Длина сообщения в заголовке превышает ёмкость изображения")
+            elif legacy is not False and self.image_size >= HEADER_PIXELS:
+                k, message_length = read_legacy_header(self.container)
+                carriers_touched = HEADER_PIXELS
+                if legacy is None and not legacy_fits(self.image_size, k, message_length):
+                    k = None
+            else:
+                k = None
             
-            # Переходим к следующей группе
-            data_index += 15
-        
-        # Преобразуем биты в байты
-        # Сначала извлекаем длину сообщения (первые 32 бита)
-        message_length = 0
-        for i in range(32):
-            if i < len(bits):
-                message_length = (message_length << 1) | bits[i]
-        
-        # Затем извлекаем само сообщение
-        message_bits = bits[32:32 + message_length*8]
-        
-        message = bytearray()
-        for i in range(0, len(message_bits), 8):
-            byte = 0
-            for j in range(8):
-                if i + j < len(message_bits):
-                    byte = (byte << 1) | message_bits[i + j]
-            message.append(byte)
-        
-        return bytes(message)
+            if k is not None and MIN_K <= k <= MAX_K:
+                self.k = k
+                
+                # Декодируем только блоки, в которых лежит само сообщение
+                n = 2 ** k - 1
+                offset = self.payload_offset(k) if header is not None else legacy_offset(k)
+                stop = min(offset + -(-message_length * 8 // k) * n, self.image_size)
+                message_bits = decode_blocks(self.container, offset, stop, k, workers)[:message_length * 8]
+                message_bits = message_bits[:len(message_bits) // 8 * 8]
+                carriers_touched += max(stop - offset, 0)
+        
+        with inst.phase('unpack'):
+            message = frame.unpack_payload(header, message_bits)
+        
+        inst.count(k=self.k, carriers_touched=carriers_touched, message_length=len(message))
+        inst.finish()
+        return message
 
 # Пример использования
 if __name__ == "__main__":
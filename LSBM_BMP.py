@@ -1,118 +1,238 @@
-import struct
-import math
-import random
+import zlib
+import numpy as np
+from BMPContainer import BMPContainer
+from instrumentation import instrument
+from streaming import DEFAULT_CHUNK_SIZE, stream_embed
+import frame
+import codec
+import keyed
 
 class LSBM_BMP:
-    def __init__(self, input_file):
+    def __init__(self, input_file, use_mmap=False, metrics=None, cache=None):
+        """
+        :param input_file: путь к BMP-файлу, bytes-like объект или файлоподобный объект
+                           (изменяемый буфер используется без копирования, embed изменяет его)
+        :param use_mmap: отобразить файл в память вместо чтения целиком
+        :param metrics: получатель замеров (функция metrics(event) или MetricsCollector)
+        :param cache: CoverCache - брать разобранный контейнер из кэша; каждое внедрение
+                      тогда получает свою копию, и объект можно использовать повторно
+        """
         self.input_file = input_file
-        self.header_size = 54  # Размер заголовка BMP для 24-битных изображений
-        
-        # Чтение файла
-        with open(input_file, 'rb') as f:
-            self.data = bytearray(f.read())
-        
-        # Проверка формата файла
-        if self.data[0] != ord('B') or self.data[1] != ord('M'):
-            raise ValueError("Файл не является BMP-форматом")
-        
-        self.image_size = len(self.data) - self.header_size
+        self.metrics = metrics
+        
+        # Разбор BMP-заголовка; пиксели доступны через container без копирования
+        inst = instrument(metrics, 'lsbm', 'load')
+        with inst.phase('load'):
+            # Запись кэша (None без кэша) и рабочий контейнер
+            self.cover = cache.get(input_file) if cache is not None else None
+            self.container = self.cover.checkout() if self.cover is not None else BMPContainer(input_file, use_mmap)
+        
+        # Размер изображения в байтах-носителях (без заголовков и выравнивания строк)
+        self.image_size = self.container.image_size
+        inst.count(image_size=self.image_size)
+        inst.finish()
+    
+    @property
+    def data(self):
+        """
+        Содержимое BMP-файла (вместе с заголовками)
+        """
+        return self.container.data
+    
+    def close(self):
+        """
+        Освобождение отображения файла в память (для use_mmap=True)
+        """
+        self.container.close()
     
-    def embed(self, message, output_file, rate=1.0):
+    def capacity(self, rate=1.0, key=None):
+        """
+        Максимальная длина сообщения (в байтах) для заданного rate
+        (с ключом - точная, floor(N * rate) носителей)
+        """
+        return frame.lsb_capacity(self.image_size, rate, key)
+    
+    def _checkout(self):
+        """
+        Новая копия-при-записи контейнера из кэша для каждого внедрения (без кэша - ничего)
+        """
+        if self.cover is not None:
+            self.container = self.cover.checkout()
+    
+    def embed(self, message, output_file=None, rate=1.0, seed=None, key=None, compress=None):
         """
         Внедрение сообщения методом LSB-Matching
+        
+        :param message: строка или байты для внедрения
+        :param output_file: имя выходного файла или файлоподобный объект;
+                            None - вернуть результат в памяти
+        :param rate: доля пикселей, используемых для внедрения (0.0-1.0)
+        :param seed: зерно (или np.random.Generator) для выбора +1/-1;
+                     при одинаковом seed результат воспроизводим
+        :param key: ключ (строка, байты или число) - носители выбираются псевдослучайной
+                    выборкой по ключу, а не с шагом step; тот же ключ нужен для извлечения
+        :param compress: сжать сообщение перед внедрением: 'auto' (самый короткий из zlib,
+                         lzma, bz2; без сжатия, если оно не помогает), 'zlib', 'lzma', 'bz2'
+                         или None - без сжатия; extract распаковывает автоматически
+        :return: при output_file=None - memoryview изображения со встроенным сообщением
+                 (без копирования; действителен, пока жив объект)
         """
+        inst = instrument(self.metrics, 'lsbm', 'embed')
+        self._checkout()
+        
         if isinstance(message, str):
             message = message.encode('utf-8')
         
-        # Добавляем длину сообщения (4 байта)
-        message_length = len(message)
-        message = struct.pack('>I', message_length) + message
+        with inst.phase('compress'):
+            raw_length = len(message)
+            message, codec_id = codec.compress(message, compress)
         
-        # Преобразуем сообщение в биты
-        bits = []
-        for byte in message:
-            bits.extend([(byte >> i) & 1 for i in range(7, -1, -1)])
+        with inst.phase('pack'):
+            # Преобразуем сообщение в биты
+            bits = np.unpackbits(np.frombuffer(message, dtype=np.uint8))
         
-        total_bits = len(bits)
-        available_bits = math.floor(self.image_size * rate)
-        
-        if total_bits > available_bits:
+        if len(message) > self.capacity(rate, key):
             raise ValueError("Сообщение слишком большое для изображения с заданным rate")
         
+        rng = np.random.default_rng(seed)
+        # Плоскость LSB контейнера из кэша избавляет от её пересчёта при каждом внедрении
+        lsb = self.cover.lsb_plane() if self.cover is not None else None
+        
+        if key is not None:
+            flipped = self._embed_keyed(message, bits, rate, key, rng, lsb, inst, codec.to_flags(codec_id))
+        else:
+            flipped = self._embed_strided(message, bits, rate, rng, lsb, inst, codec.to_flags(codec_id))
+        
+        # Сохранение результата (в памяти результат возвращается без копирования)
+        if output_file is not None:
+            with inst.phase('write'):
+                self.container.save(output_file)
+        
+        inst.count(rate=rate, carriers_touched=frame.FRAME_BITS + len(bits),
+                   bits_embedded=frame.FRAME_BITS + len(bits), bits_flipped=flipped,
+                   message_length=raw_length, payload_length=len(message))
+        inst.finish()
+        
+        if output_file is None:
+            return self.container.buffer()
+    
+    def _embed_strided(self, message, bits, rate, rng, lsb, inst, flags=0):
+        """
+        Кадр и сообщение в носителях с шагом step, возвращает число изменённых байтов
+        """
         # Внедряем биты с использованием LSB-Matching
-        bit_index = 0
-        step = math.ceil(1 / rate) if rate < 1.0 else 1
-        
-        for i in range(self.header_size, len(self.data)):
-            if (i - self.header_size) % step == 0 and bit_index < total_bits:
-                current_bit = bits[bit_index]
-                current_byte = self.data[i]
-                current_lsb = current_byte & 1
-                
-                if current_bit == current_lsb:
-                    # Бит уже совпадает - ничего не меняем
-                    pass
-                else:
-                    if current_byte == 0:
-                        # Особый случай: можно только увеличить на 1
-                        self.data[i] = 1
-                    elif current_byte == 255:
-                        # Особый случай: можно только уменьшить на 1
-                        self.data[i] = 254
-                    else:
-                        # Случайный выбор между +1 и -1
-                        # Если скрываемый бит = 1, а последний бит self.data[i] будет = 0, то при +1 или -1, последний бит self.data[i] всё равно станет = 1
-                        # И наоборот, если скрываемый бит = 0, а последний бит self.data[i] будет = 1, то при +1 или -1, последний бит self.data[i] всё равно станет = 0
-                        self.data[i] = current_byte + random.choice([-1, 1])
-                
-                bit_index += 1
-        
-        # Сохранение результата
-        with open(output_file, 'wb') as f:
-            f.write(self.data)
+        step = frame.lsb_step(rate)
+        offset = frame.payload_offset(step)
+        
+        with inst.phase('embed'):
+            with self.container.carriers(0, offset + len(bits) * step) as pixels:
+                # Кадр (метод, шаг, длина, CRC) - в первые носители подряд, сообщение - с шагом step
+                header = frame.pack_frame(frame.METHOD_LSBM, step, len(message), zlib.crc32(message), flags)
+                flipped = self._embed_bits(pixels[:frame.FRAME_BITS], header, 1, rng,
+                                           lsb[:frame.FRAME_BITS] if lsb is not None else None)
+                flipped += self._embed_bits(pixels[offset:], bits, step, rng,
+                                            lsb[offset:] if lsb is not None else None)
+        return flipped
     
-    def extract(self, rate=1.0):
+    def _embed_keyed(self, message, bits, rate, key, rng, lsb, inst, flags=0):
+        """
+        Кадр в первых носителях, сообщение - в носителях, выбранных выборкой по ключу,
+        возвращает число изменённых байтов
+        """
+        param = keyed.rate_param(rate)
+        with inst.phase('pack'):
+            index, gamma = keyed.carriers(key, self.image_size, len(bits))
+            bits = bits ^ gamma
+        
+        with inst.phase('embed'):
+            with self.container.carriers(0, frame.FRAME_BITS) as pixels:
+                header = frame.pack_frame(frame.METHOD_LSBM, param, len(message), zlib.crc32(message),
+                                         flags | frame.FLAG_KEYED)
+                flipped = self._embed_bits(pixels, header, 1, rng,
+                                           lsb[:frame.FRAME_BITS] if lsb is not None else None)
+            # Носители сообщения собираются и записываются обратно одной индексацией массивом
+            carriers = self.container.take_index(index)
+            flipped += self._embed_bits(carriers, bits, 1, rng, lsb[index] if lsb is not None else None)
+            self.container.put_index(carriers, index)
+        return flipped
+    
+    def embed_stream(self, source, output_file, rate=1.0, seed=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Потоковое внедрение методом LSB-Matching: контейнер читается и записывается
+        кусками, поэтому в памяти никогда не находится целиком
+        (объект, созданный по пути, читает из файла только заголовки)
+        
+        :param source: строка, байты, файлоподобный объект или итерируемый объект с кусками байтов
+        :param output_file: имя выходного файла или файлоподобный объект (с seek)
+        :param rate: доля пикселей, используемых для внедрения (0.0-1.0)
+        :param seed: зерно (или np.random.Generator) для выбора +1/-1
+        :param chunk_size: размер читаемого куска в байтах
+        """
+        inst = instrument(self.metrics, 'lsbm', 'embed_stream')
+        self._checkout()
+        step = frame.lsb_step(rate)
+        offset = frame.payload_offset(step)
+        rng = np.random.default_rng(seed)
+        
+        def embed_header(pixels, payload):
+            header = frame.pack_frame(frame.METHOD_LSBM, step, payload.length, payload.crc)
+            self._embed_bits(pixels, header, 1, rng)
+        
+        with inst.phase('stream'):
+            stream_embed(self.container, output_file, source, step, 1, self.capacity(rate) * 8,
+                         lambda pixels, bits: self._embed_bits(pixels, bits, step, rng),
+                         offset, embed_header, chunk_size)
+        inst.count(rate=rate)
+        inst.finish()
+    
+    def _embed_bits(self, pixels, bits, step, rng, lsb=None):
+        """
+        LSB-Matching битов bits в носители pixels[::step], возвращает число изменённых байтов
+        
+        :param lsb: младшие биты pixels, вычисленные заранее (None - взять из pixels)
+        """
+        carriers = pixels[::step][:len(bits)]
+        bits = bits[:len(carriers)]
+        current = lsb[::step][:len(bits)] if lsb is not None else carriers & 1
+        
+        # Маска носителей, у которых LSB не совпадает со скрываемым битом
+        # (там, где бит уже совпадает, ничего не меняем)
+        mismatch = np.flatnonzero(current != bits)
+        values = carriers[mismatch]
+        
+        # Случайный выбор между +1 и -1 одним пакетом для всех несовпадений.
+        # Если скрываемый бит = 1, а последний бит байта = 0, то при +1 или -1 последний бит всё равно станет = 1
+        # И наоборот, если скрываемый бит = 0, а последний бит байта = 1, то при +1 или -1 последний бит всё равно станет = 0
+        delta = rng.integers(0, 2, size=len(mismatch), dtype=np.int16) * 2 - 1
+        # Особые случаи: 0 можно только увеличить, 255 - только уменьшить
+        delta[values == 0] = 1
+        delta[values == 255] = -1
+        carriers[mismatch] = (values + delta).astype(np.uint8)
+        return len(mismatch)
+    
+    def extract(self, rate=None, key=None):
         """
         Извлечение сообщения (аналогично LSB-R, так как биты все равно в LSB)
+        
+        Параметры внедрения берутся из кадра, поэтому rate указывать не нужно.
+        Если кадра нет, при rate=None сразу возвращается b'', а при заданном rate
+        сообщение читается в старом формате (4 байта длины + сообщение с шагом step)
+        
+        :param rate: доля пикселей, использованная при внедрении (только для старого формата)
+        :param key: ключ, если сообщение внедрено с ключом
         """
-        bits = []
-        step = math.ceil(1 / rate) if rate < 1.0 else 1
-        max_bits = 4 * 8  # Максимум для длины сообщения
-        
-        length_bits = []
-        length_extracted = False
-        message_length = 0
-        
-        for i in range(self.header_size, len(self.data)):
-            if (i - self.header_size) % step == 0:
-                bit = self.data[i] & 1
-                bits.append(bit)
-                length_bits.append(bit)
-                
-                if len(length_bits) == 32 and not length_extracted:
-                    message_length = 0
-                    for j in range(32):
-                        message_length = (message_length << 1) | length_bits[j]
-                    length_extracted = True
-                    max_bits = 32 + message_length * 8
-                
-                if len(bits) >= max_bits:
-                    break
-        
-        if not length_extracted:
-            return b''
-        
-        message_bits = bits[32:32 + message_length * 8]
-        
-        message = bytearray()
-        for i in range(0, len(message_bits), 8):
-            byte = 0
-            for j in range(8):
-                if i + j < len(message_bits):
-                    byte = (byte << 1) | message_bits[i + j]
-            message.append(byte)
-        
-        return bytes(message)
+        inst = instrument(self.metrics, 'lsbm', 'extract')
+        
+        with inst.phase('extract'):
+            header, message_bits, carriers_touched = frame.read_lsb(self.container, rate, key)
+        
+        # Преобразуем биты в байты
+        with inst.phase('unpack'):
+            message = frame.unpack_payload(header, message_bits)
+        
+        inst.count(rate=rate, carriers_touched=carriers_touched, message_length=len(message))
+        inst.finish()
+        return message
 
 # Пример использования
 if __name__ == "__main__":
@@ -1,132 +1,218 @@
-import struct
-import math
+import zlib
+import numpy as np
+from BMPContainer import BMPContainer
+from instrumentation import instrument
+from streaming import DEFAULT_CHUNK_SIZE, stream_embed
+import frame
+import codec
+import keyed
 
 class LSBR_BMP:
-    def __init__(self, input_file):
+    def __init__(self, input_file, use_mmap=False, metrics=None, cache=None):
+        """
+        :param input_file: путь к BMP-файлу, bytes-like объект или файлоподобный объект
+                           (изменяемый буфер используется без копирования, embed изменяет его)
+        :param use_mmap: отобразить файл в память вместо чтения целиком
+        :param metrics: получатель замеров (функция metrics(event) или MetricsCollector)
+        :param cache: CoverCache - брать разобранный контейнер из кэша; каждое внедрение
+                      тогда получает свою копию, и объект можно использовать повторно
+        """
         self.input_file = input_file
-        self.header_size = 54  # Размер заголовка BMP (для 24-битных изображений)
-        
-        # Чтение файла
-        with open(input_file, 'rb') as f:
-            self.data = bytearray(f.read())
-        # print(ord('B'))
+        self.metrics = metrics
         
-        # Проверка, что это BMP-файл
-        if self.data[0] != ord('B') or self.data[1] != ord('M'):
-            raise ValueError("Файл не является BMP-форматом")
+        # Разбор BMP-заголовка; пиксели доступны через container без копирования
+        inst = instrument(metrics, 'lsbr', 'load')
+        with inst.phase('load'):
+            # Запись кэша (None без кэша) и рабочий контейнер
+            self.cover = cache.get(input_file) if cache is not None else None
+            self.container = self.cover.checkout() if self.cover is not None else BMPContainer(input_file, use_mmap)
         
-        # Получаем размер изображения (без заголовка)
-        self.image_size = len(self.data) - self.header_size
+        # Размер изображения в байтах-носителях (без заголовков и выравнивания строк)
+        self.image_size = self.container.image_size
+        inst.count(image_size=self.image_size)
+        inst.finish()
+    
+    @property
+    def data(self):
+        """
+        Содержимое BMP-файла (вместе с заголовками)
+        """
+        return self.container.data
+    
+    def close(self):
+        """
+        Освобождение отображения файла в память (для use_mmap=True)
+        """
+        self.container.close()
+    
+    def capacity(self, rate=1.0, key=None):
+        """
+        Максимальная длина сообщения (в байтах) для заданного rate
+        (с ключом - точная, floor(N * rate) носителей)
+        """
+        return frame.lsb_capacity(self.image_size, rate, key)
+    
+    def _checkout(self):
+        """
+        Новая копия-при-записи контейнера из кэша для каждого внедрения (без кэша - ничего)
+        """
+        if self.cover is not None:
+            self.container = self.cover.checkout()
     
-    def embed(self, message, output_file, rate=1.0):
+    def embed(self, message, output_file=None, rate=1.0, key=None, compress=None):
         """
         Внедрение сообщения в изображение методом LSB-R
         
         :param message: строка или байты для внедрения
-        :param output_file: имя выходного файла
+        :param output_file: имя выходного файла или файлоподобный объект;
+                            None - вернуть результат в памяти
         :param rate: доля пикселей, используемых для внедрения (0.0-1.0)
+        :param key: ключ (строка, байты или число) - носители выбираются псевдослучайной
+                    выборкой по ключу, а не с шагом step; тот же ключ нужен для извлечения
+        :param compress: сжать сообщение перед внедрением: 'auto' (самый короткий из zlib,
+                         lzma, bz2; без сжатия, если оно не помогает), 'zlib', 'lzma', 'bz2'
+                         или None - без сжатия; extract распаковывает автоматически
+        :return: при output_file=None - memoryview изображения со встроенным сообщением
+                 (без копирования; действителен, пока жив объект)
         """
+        inst = instrument(self.metrics, 'lsbr', 'embed')
+        self._checkout()
+        
         if isinstance(message, str):
             message = message.encode('utf-8')
         
-        # Добавляем длину сообщения в первые 4 байта
-        message_length = len(message)
-        message = struct.pack('>I', message_length) + message
-        print('message_length', message_length * 8)
-        # Преобразуем сообщение в биты
-        bits = []
-        for byte in message:
-            bits.extend([(byte >> i) & 1 for i in range(7, -1, -1)])
+        with inst.phase('compress'):
+            raw_length = len(message)
+            message, codec_id = codec.compress(message, compress)
         
-        total_bits = len(bits)
-        print('image_size', self.image_size)
-        available_bits = math.floor(self.image_size * rate)  # 3 бита на пиксель (RGB)
+        with inst.phase('pack'):
+            # Преобразуем сообщение в биты
+            bits = np.unpackbits(np.frombuffer(message, dtype=np.uint8))
         
-        if total_bits > available_bits:
+        if len(message) > self.capacity(rate, key):
             raise ValueError("Сообщение слишком большое для изображения с заданным rate")
-
-        print(len(self.data))
-        print('total_bits ', total_bits, 'available_bits ', available_bits)
-
+        
+        if key is not None:
+            flipped, payload_flipped = self._embed_keyed(message, bits, rate, key, inst, codec.to_flags(codec_id))
+        else:
+            flipped, payload_flipped = self._embed_strided(message, bits, rate, inst, codec.to_flags(codec_id))
+        
+        # Сохраняем результат (в памяти результат возвращается без копирования)
+        if output_file is not None:
+            with inst.phase('write'):
+                self.container.save(output_file)
+        
+        inst.count(rate=rate, carriers_touched=frame.FRAME_BITS + len(bits),
+                   bits_embedded=frame.FRAME_BITS + len(bits),
+                   bits_flipped=flipped + payload_flipped if inst.enabled else None,
+                   message_length=raw_length, payload_length=len(message))
+        inst.finish()
+        
+        if output_file is None:
+            return self.container.buffer()
+    
+    def _embed_strided(self, message, bits, rate, inst, flags=0):
+        """
+        Кадр и сообщение в носителях с шагом step, возвращает числа изменённых битов
+        """
         # Внедряем биты в младшие биты пикселей
-        bit_index = 0
-        step = math.ceil(1 / rate) if rate < 1.0 else 1 # шаг между пикселями
-        
-        for i in range(self.header_size, len(self.data)):
-            # print(i)
-            # if bit_index >= total_bits:
-            #     break
-            # if (i - self.header_size) % step == 0:
-            # print((i - self.header_size) % step)
-            if (i - self.header_size) % step == 0 and bit_index < total_bits:
-                # Заменяем LSB на бит сообщения
-                # print(f"Встраиваемый бит: {bits[bit_index]}")
-                # print(f"До встраивания: {self.data[i]:08b}")
-                self.data[i] = (self.data[i] & 0xFE) | bits[bit_index]
-                # print(f"После встраивания: {self.data[i]:08b}")
-                bit_index += 1
-            # print(bit_index)
-        
-        print(bit_index)
-        # Сохраняем результат
-        with open(output_file, 'wb') as f:
-            f.write(self.data)
+        step = frame.lsb_step(rate) # шаг между пикселями
+        offset = frame.payload_offset(step)
+        
+        with inst.phase('embed'):
+            with self.container.carriers(0, offset + len(bits) * step) as pixels:
+                # Кадр (метод, шаг, длина, CRC) - в первые носители подряд, сообщение - с шагом step
+                header = frame.pack_frame(frame.METHOD_LSBR, step, len(message), zlib.crc32(message), flags)
+                flipped = self._embed_bits(pixels[:frame.FRAME_BITS], header, 1, inst.enabled)
+                payload_flipped = self._embed_bits(pixels[offset:], bits, step, inst.enabled)
+        return flipped, payload_flipped
+    
+    def _embed_keyed(self, message, bits, rate, key, inst, flags=0):
+        """
+        Кадр в первых носителях, сообщение - в носителях, выбранных выборкой по ключу,
+        возвращает числа изменённых битов
+        """
+        param = keyed.rate_param(rate)
+        with inst.phase('pack'):
+            index, gamma = keyed.carriers(key, self.image_size, len(bits))
+            bits = bits ^ gamma
+        
+        with inst.phase('embed'):
+            with self.container.carriers(0, frame.FRAME_BITS) as pixels:
+                header = frame.pack_frame(frame.METHOD_LSBR, param, len(message), zlib.crc32(message),
+                                         flags | frame.FLAG_KEYED)
+                flipped = self._embed_bits(pixels, header, 1, inst.enabled)
+            # Носители сообщения собираются и записываются обратно одной индексацией массивом
+            carriers = self.container.take_index(index)
+            payload_flipped = self._embed_bits(carriers, bits, 1, inst.enabled)
+            self.container.put_index(carriers, index)
+        return flipped, payload_flipped
+    
+    def embed_stream(self, source, output_file, rate=1.0, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Потоковое внедрение методом LSB-R: контейнер читается и записывается
+        кусками, поэтому в памяти никогда не находится целиком
+        (объект, созданный по пути, читает из файла только заголовки)
+        
+        :param source: строка, байты, файлоподобный объект или итерируемый объект с кусками байтов
+        :param output_file: имя выходного файла или файлоподобный объект (с seek)
+        :param rate: доля пикселей, используемых для внедрения (0.0-1.0)
+        :param chunk_size: размер читаемого куска в байтах
+        """
+        inst = instrument(self.metrics, 'lsbr', 'embed_stream')
+        self._checkout()
+        step = frame.lsb_step(rate)
+        offset = frame.payload_offset(step)
+        
+        def embed_header(pixels, payload):
+            header = frame.pack_frame(frame.METHOD_LSBR, step, payload.length, payload.crc)
+            self._embed_bits(pixels, header, 1)
+        
+        with inst.phase('stream'):
+            stream_embed(self.container, output_file, source, step, 1, self.capacity(rate) * 8,
+                         lambda pixels, bits: self._embed_bits(pixels, bits, step),
+                         offset, embed_header, chunk_size)
+        inst.count(rate=rate)
+        inst.finish()
     
-    def extract(self, rate=1.0):
+    def _embed_bits(self, pixels, bits, step, count_flips=False):
+        """
+        Замена LSB носителей pixels[::step] битами bits
+        
+        :return: число изменённых битов (если count_flips), иначе None
+        """
+        # Пиксели-носители выбираются одним срезом с шагом step (view без копирования)
+        carriers = pixels[::step][:len(bits)]
+        bits = bits[:len(carriers)]
+        flipped = int(np.count_nonzero((carriers & 1) != bits)) if count_flips else None
+        carriers &= 0xFE
+        carriers |= bits
+        return flipped
+    
+    def extract(self, rate=None, key=None):
         """
         Извлечение сообщения из изображения
         
-        :param rate: доля пикселей, используемых для извлечения (0.0-1.0)
+        Параметры внедрения берутся из кадра, поэтому rate указывать не нужно.
+        Если кадра нет, при rate=None сразу возвращается b'', а при заданном rate
+        сообщение читается в старом формате (4 байта длины + сообщение с шагом step)
+        
+        :param rate: доля пикселей, использованная при внедрении (только для старого формата)
+        :param key: ключ, если сообщение внедрено с ключом
         :return: извлеченное сообщение (в байтах)
         """
-        bits = []
-        step = math.ceil(1 / rate) if rate < 1.0 else 1
-        max_bits = 4 * 8  # 4 байта для длины сообщения (32 бита)
-        
-        # Сначала извлекаем длину сообщения (первые 32 бита)
-        length_bits = []
-        length_extracted = False
-        message_length = 0
-        print('len(self.data)', len(self.data))
-        for i in range(self.header_size, len(self.data)):
-            if (i - self.header_size) % step == 0:
-                # Извлекаем LSB
-                bit = self.data[i] & 1
-                length_bits.append(bit)
-                # print(len(length_bits))
-                
-                if len(length_bits) == 32 and not length_extracted:
-                    # Преобразуем биты в длину сообщения
-                    message_length = 0
-                    for j in range(32):
-                        message_length = (message_length << 1) | length_bits[j]
-                    length_extracted = True
-                    max_bits = 32 + message_length * 8
-                
-                if len(bits) >= max_bits:
-                    break
-        print('max_bits', max_bits)
-        print(len(bits))
-        # Если не удалось извлечь длину сообщения
-        if not length_extracted:
-            return b''
-        print('len(length_bits)', len(length_bits))
-        # Извлекаем само сообщение
-        print('message_length', message_length)
-        message_bits = length_bits[32:32 + message_length * 8]
-        print('32 + message_length * 8', 32 + message_length * 8)
-        print(len(message_bits))
+        inst = instrument(self.metrics, 'lsbr', 'extract')
+        
+        with inst.phase('extract'):
+            header, message_bits, carriers_touched = frame.read_lsb(self.container, rate, key)
         
         # Преобразуем биты в байты
-        message = bytearray()
-        for i in range(0, len(message_bits), 8):
-            byte = 0
-            for j in range(8):
-                if i + j < len(message_bits):
-                    byte = (byte << 1) | message_bits[i + j]
-            message.append(byte)
-        
-        return bytes(message)
+        with inst.phase('unpack'):
+            message = frame.unpack_payload(header, message_bits)
+        
+        inst.count(rate=rate, carriers_touched=carriers_touched, message_length=len(message))
+        inst.finish()
+        return message
 
 # Пример использования
 if __name__ == "__main__":
@@ -0,0 +1,397 @@
+"""
+Оценка качества стего-изображений и стегоанализ по парам контейнер/стего.
+
+Для каждой пары вычисляются MSE, PSNR, доля изменённых байтов-носителей и
+эффективность встраивания (битов сообщения на одно изменение), а для
+стего-изображения - атака хи-квадрат (Вестфельд-Пфицман) и RS-анализ
+(Фридрих). Пиксели читаются через mmap и обрабатываются кусками векторными
+операциями NumPy, пары распределяются по процессам.
+
+Пары задаются явно (--pair cover.bmp stego.bmp [метод [rate]]) или каталогами:
+стего-файл сопоставляется контейнеру по имени в формате main.py и batch.py,
+<контейнер>_<метод>[_<rate>].bmp.
+
+Пример:
+    python analysis.py --covers covers/ --stegos out/ --workers 8 --output metrics.jsonl
+"""
+import os
+import sys
+import json
+import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Сколько носителей обрабатывать за один проход (ограничивает память на временные массивы)
+CHUNK_CARRIERS = 1 << 22
+
+# Маска RS-анализа для групп из 4 соседних носителей одного канала
+RS_MASK = (0, 1, 1, 0)
+
+# Число точек кривой хи-квадрат (по возрастающим долям изображения)
+CHI_POINTS = 10
+
+# Суффиксы rate в именах файлов-примеров (life_lsbr_25.bmp - это rate 0.25);
+# в остальных именах rate записан как число, например life_lsbr_0.25.bmp
+SAMPLE_RATES = {'1': 1.0, '5': 0.5, '25': 0.25}
+
+
+def _chunks(container, align=1):
+    """
+    Носители контейнера кусками (длина куска кратна align)
+    """
+    size = max(CHUNK_CARRIERS // align, 1) * align
+    for start in range(0, container.image_size, size):
+        yield container.take(start, min(start + size, container.image_size))
+
+
+def chi_square_p(chi2, dof):
+    """
+    Вероятность P(X >= chi2) для распределения хи-квадрат с dof степенями свободы
+    (приближение Уилсона-Хилферти)
+    """
+    if dof <= 0:
+        return None
+    z = ((chi2 / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def chi_square(histograms):
+    """
+    Атака хи-квадрат по гистограммам значений байтов
+
+    :param histograms: массив (..., 256)
+    :return: (статистика, число степеней свободы, вероятность встраивания) по последней оси;
+             вероятность близка к 1, если значения в парах (2i, 2i+1) выровнены,
+             как после замены LSB
+    """
+    import numpy as np
+
+    pairs = histograms.reshape(*histograms.shape[:-1], 128, 2).astype(np.float64)
+    expected = pairs.sum(axis=-1) / 2
+    used = expected > 0
+    chi2 = np.where(used, (pairs[..., 0] - expected) ** 2 / np.where(used, expected, 1), 0).sum(axis=-1)
+    dof = used.sum(axis=-1) - 1
+    p = [chi_square_p(float(c), int(d)) for c, d in zip(np.ravel(chi2), np.ravel(dof))]
+    return chi2, dof, np.array(p, dtype=np.float64).reshape(np.shape(chi2))
+
+
+def _rs_counts(groups, mask):
+    """
+    Число регулярных и сингулярных групп (строки groups) для маски mask
+    и для изображения с инвертированными LSB
+    """
+    import numpy as np
+
+    mask = np.asarray(mask)
+    groups = groups.astype(np.int16)
+    counts = []
+    for values in (groups, groups ^ 1):
+        f = np.abs(np.diff(values, axis=1)).sum(axis=1)
+        for m in (mask, -mask):
+            flipped = values.copy()
+            # F1: 0<->1, 2<->3, ...; F-1: -1<->0, 1<->2, ... (F-1(x) = F1(x + 1) - 1)
+            flipped[:, m == 1] ^= 1
+            flipped[:, m == -1] = ((flipped[:, m == -1] + 1) ^ 1) - 1
+            f_m = np.abs(np.diff(flipped, axis=1)).sum(axis=1)
+            counts += [int(np.count_nonzero(f_m > f)), int(np.count_nonzero(f_m < f))]
+    return np.array(counts, dtype=np.int64)
+
+
+def rs_estimate(counts, total):
+    """
+    Оценка доли внедрения по счётчикам RS-анализа
+
+    :param counts: [R_M, S_M, R_-M, S_-M] для изображения и для изображения с инвертированными LSB
+    :param total: число групп
+    :return: оценка доли носителей с сообщением (0 - чистое изображение) или None
+    """
+    if not total:
+        return None
+    r_m, s_m, r_nm, s_nm, r_m1, s_m1, r_nm1, s_nm1 = (c / total for c in counts)
+    d0, d1 = r_m - s_m, r_m1 - s_m1
+    dn0, dn1 = r_nm - s_nm, r_nm1 - s_nm1
+
+    a = 2 * (d1 + d0)
+    b = dn0 - dn1 - d1 - 3 * d0
+    c = d0 - dn0
+    if abs(a) < 1e-12:
+        if abs(b) < 1e-12:
+            return None
+        x = -c / b
+    else:
+        disc = b * b - 4 * a * c
+        if disc < 0:
+            return None
+        roots = ((-b + math.sqrt(disc)) / (2 * a), (-b - math.sqrt(disc)) / (2 * a))
+        x = min(roots, key=abs)
+    if x == 0.5:
+        return None
+    return x / (x - 0.5)
+
+
+def steganalysis(container):
+    """
+    Атака хи-квадрат и RS-анализ одного изображения
+
+    :return: словарь chi_square (вероятность по всему изображению), chi_square_curve
+             (по первым 1/10, 2/10, ... носителей) и rs (оценка доли внедрения,
+             для 24/32-битных изображений - среднее по каналам)
+    """
+    import numpy as np
+
+    channels = container.bits_per_pixel // 8 if container.bits_per_pixel in (24, 32) else 1
+    group = len(RS_MASK)
+
+    # Гистограммы по CHI_POINTS равным частям: накопленная сумма даёт кривую без повторного прохода
+    points = min(CHI_POINTS, max(container.image_size, 1))
+    bounds = np.linspace(0, container.image_size, points + 1).astype(np.int64)
+    histograms = np.zeros((points, 256), dtype=np.int64)
+    rs_counts = np.zeros((channels, 8), dtype=np.int64)
+    rs_total = np.zeros(channels, dtype=np.int64)
+
+    start = 0
+    for chunk in _chunks(container, channels * group):
+        # Номер части для каждого носителя и одна гистограмма по всем частям сразу
+        part = np.searchsorted(bounds[1:], np.arange(start, start + len(chunk)), side='right')
+        histograms += np.bincount(part * 256 + chunk, minlength=points * 256).reshape(points, 256)
+        start += len(chunk)
+
+        # Группы по 4 соседних значения одного канала
+        usable = len(chunk) // (channels * group) * channels * group
+        planes = chunk[:usable].reshape(-1, channels)
+        for c in range(channels):
+            groups = planes[:, c].reshape(-1, group)
+            rs_counts[c] += _rs_counts(groups, RS_MASK)
+            rs_total[c] += len(groups)
+
+    _, _, curve = chi_square(np.cumsum(histograms, axis=0))
+    estimates = [rs_estimate(rs_counts[c], int(rs_total[c])) for c in range(channels)]
+    estimates = [e for e in estimates if e is not None]
+    return {
+        'chi_square': float(curve[-1]) if points else None,
+        'chi_square_curve': [float(p) for p in curve],
+        'rs': sum(estimates) / len(estimates) if estimates else None,
+        'rs_channels': estimates,
+    }
+
+
+def embedded_bits(container, method=None, rate=None):
+    """
+    Сколько битов внедрено (кадр и сообщение) по кадру или по заголовку старого формата
+    """
+    import frame
+
+    header = frame.read_frame(container)
+    if header is not None:
+        return frame.FRAME_BITS + header.length * 8
+    if method == 'hamming':
+        import HammingStego
+        legacy = HammingStego.read_legacy_header(container)
+        if legacy is None or not HammingStego.legacy_fits(container.image_size, *legacy):
+            return None
+        length = legacy[1]
+    elif method in ('lsbr', 'lsbm') and rate is not None:
+        step = frame.lsb_step(rate)
+        length = frame.read_legacy_length(container, step)
+        if length is None or not frame.legacy_lsb_fits(container.image_size, step, length):
+            return None
+    else:
+        return None
+    return 32 + length * 8 if length else None
+
+
+def compare(cover, stego, method=None, rate=None, analyze=True):
+    """
+    Метрики пары контейнер/стего-изображение
+
+    :param cover: путь к контейнеру
+    :param stego: путь к стего-изображению
+    :param method: метод ('lsbr', 'lsbm', 'hamming'), нужен только для файлов старого формата
+    :param rate: rate внедрения, нужен только для файлов старого формата LSB
+    :param analyze: выполнить стегоанализ стего-изображения
+    """
+    import numpy as np
+    from BMPContainer import BMPContainer
+
+    a = BMPContainer(cover, use_mmap=True)
+    b = BMPContainer(stego, use_mmap=True)
+    try:
+        if (a.width, a.height, a.bits_per_pixel) != (b.width, b.height, b.bits_per_pixel):
+            raise ValueError("Размеры контейнера и стего-изображения не совпадают")
+
+        squared = changed = lsb_changed = 0
+        for start in range(0, a.image_size, CHUNK_CARRIERS):
+            stop = min(start + CHUNK_CARRIERS, a.image_size)
+            x, y = a.take(start, stop), b.take(start, stop)
+            diff = x.astype(np.int16) - y
+            squared += int(np.dot(diff.astype(np.int64), diff))
+            changed += int(np.count_nonzero(diff))
+            lsb_changed += int(np.count_nonzero((x ^ y) & 1))
+
+        mse = squared / a.image_size if a.image_size else 0.0
+        bits = embedded_bits(b, method, rate)
+        result = {
+            'cover': cover,
+            'stego': stego,
+            'method': method,
+            'rate': rate,
+            'carriers': a.image_size,
+            'mse': mse,
+            # Для одинаковых изображений PSNR бесконечен (None в JSON)
+            'psnr': 10 * math.log10(255 ** 2 / mse) if mse else None,
+            'changed': changed,
+            'changed_ratio': changed / a.image_size if a.image_size else 0.0,
+            'lsb_changed_ratio': lsb_changed / a.image_size if a.image_size else 0.0,
+            'bits_embedded': bits,
+            'efficiency': bits / changed if bits is not None and changed else None,
+        }
+        if analyze:
+            result['stego_analysis'] = steganalysis(b)
+        return result
+    finally:
+        a.close()
+        b.close()
+
+
+def pair_files(covers, stegos):
+    """
+    Пары (контейнер, стего, метод, rate) по каталогам: стего-файлы с именами
+    <контейнер>_<метод>[_<rate>].bmp, как их называют main.py и batch.py
+    (rate вне (0, 1] считается неизвестным - None)
+    """
+    from batch import METHODS
+
+    cover_files = {
+        os.path.splitext(name)[0]: os.path.join(covers, name)
+        for name in os.listdir(covers) if name.lower().endswith('.bmp')
+    }
+    pairs = []
+    for name in sorted(os.listdir(stegos)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() != '.bmp':
+            continue
+        for method in METHODS:
+            base, sep, tail = stem.partition(f"_{method}")
+            if not sep or base not in cover_files or (tail and not tail.startswith('_')):
+                continue
+            rate = None
+            if tail[1:] in SAMPLE_RATES:
+                rate = SAMPLE_RATES[tail[1:]]
+            elif tail:
+                try:
+                    rate = float(tail[1:])
+                except ValueError:
+                    continue
+                if not 0 < rate <= 1:
+                    rate = None
+            pairs.append((cover_files[base], os.path.join(stegos, name), method, rate))
+            break
+    return pairs
+
+
+def _compare_pair(pair, analyze=True):
+    try:
+        return compare(*pair, analyze=analyze)
+    except (OSError, ValueError) as e:
+        cover, stego, method, rate = pair
+        return {'cover': cover, 'stego': stego, 'method': method, 'rate': rate, 'error': str(e)}
+
+
+def evaluate(pairs, workers=None, analyze=True):
+    """
+    Метрики для списка пар в пуле процессов; результаты выдаются по порядку пар
+    (при workers=1 всё выполняется в текущем процессе)
+    """
+    if workers == 1 or len(pairs) <= 1:
+        for pair in pairs:
+            yield _compare_pair(pair, analyze)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_compare_pair, pairs, [analyze] * len(pairs),
+                            chunksize=max(len(pairs) // (4 * (workers or os.cpu_count() or 1)), 1))
+
+
+def summarize(results):
+    """
+    Средние значения метрик по (метод, rate)
+    """
+    keys = ('mse', 'psnr', 'changed_ratio', 'lsb_changed_ratio', 'efficiency')
+    groups = {}
+    for result in results:
+        if 'error' in result:
+            continue
+        item = groups.setdefault((result['method'], result['rate']), {'count': 0})
+        item['count'] += 1
+        values = {key: result.get(key) for key in keys}
+        analysis = result.get('stego_analysis')
+        if analysis:
+            values.update(chi_square=analysis['chi_square'], rs=analysis['rs'])
+        for key, value in values.items():
+            if value is not None and math.isfinite(value):
+                item.setdefault(key, []).append(value)
+
+    summary = []
+    for (method, rate), item in sorted(groups.items(), key=lambda kv: (str(kv[0][0]), kv[0][1] or 0)):
+        row = {'method': method, 'rate': rate, 'count': item.pop('count')}
+        row.update({key: sum(values) / len(values) for key, values in item.items()})
+        summary.append(row)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Метрики качества и стегоанализ пар контейнер/стего")
+    parser.add_argument('--covers', help="каталог с контейнерами")
+    parser.add_argument('--stegos', help="каталог со стего-изображениями")
+    parser.add_argument('--pair', nargs='+', action='append', default=[], metavar='COVER STEGO [METHOD [RATE]]',
+                        help="явная пара файлов, метод и rate - для файлов старого формата (можно повторять)")
+    parser.add_argument('--workers', type=int, default=None, help="число процессов (по умолчанию - число ядер)")
+    parser.add_argument('--no-analysis', action='store_true', help="не выполнять хи-квадрат и RS-анализ")
+    parser.add_argument('--output', help="файл для результатов (JSON lines), по умолчанию - stdout")
+    parser.add_argument('--summary', help="файл для средних значений по методу и rate (JSON)")
+    args = parser.parse_args(argv)
+
+    from batch import METHODS
+
+    pairs = []
+    for pair in args.pair:
+        if not 2 <= len(pair) <= 4:
+            parser.error("--pair: нужны COVER STEGO [METHOD [RATE]]")
+        cover, stego, method, rate = pair + [None] * (4 - len(pair))
+        if method is not None and method not in METHODS:
+            parser.error(f"--pair: неизвестный метод {method}")
+        if rate is not None:
+            try:
+                rate = float(rate)
+            except ValueError:
+                rate = -1
+            if not 0 < rate <= 1:
+                parser.error(f"--pair: rate должен быть в (0, 1]: {pair[3]}")
+        pairs.append((cover, stego, method, rate))
+    if args.covers or args.stegos:
+        if not (args.covers and args.stegos):
+            parser.error("--covers и --stegos задаются вместе")
+        pairs += pair_files(args.covers, args.stegos)
+    if not pairs:
+        parser.error("нет пар для сравнения")
+
+    results = []
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for result in evaluate(pairs, args.workers, not args.no_analysis):
+            if args.summary:
+                results.append(result)
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summarize(results), f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
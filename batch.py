@@ -0,0 +1,197 @@
+"""
+Пакетное (неинтерактивное) внедрение сообщений в набор контейнеров.
+
+Задания распределяются по процессам через ProcessPoolExecutor. Модули методов
+(и вместе с ними NumPy) импортируются только в тех процессах и только для тех
+методов, которые действительно нужны.
+"""
+import os
+import json
+import time
+import importlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from instrumentation import MetricsCollector
+
+# Метод -> (модуль, класс, принимает ли embed/extract параметр rate)
+METHODS = {
+    'lsbr': ('LSBR_BMP', 'LSBR_BMP', True),
+    'lsbm': ('LSBM_BMP', 'LSBM_BMP', True),
+    'hamming': ('HammingStego', 'HammingStego', False),
+}
+
+# Кэш контейнеров процесса (создаётся в run_job): задания одного контейнера
+# (разные методы и rate) не перечитывают и не разбирают его заново
+_COVERS = None
+
+
+def load_method(method):
+    """
+    Ленивая загрузка класса метода по имени ('lsbr', 'lsbm', 'hamming')
+    """
+    if method not in METHODS:
+        raise ValueError(f"Неизвестный метод: {method}")
+    module_name, class_name, _ = METHODS[method]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def check_methods(methods):
+    """
+    Проверка имён методов: ValueError со списком неизвестных
+    """
+    unknown = [method for method in methods if method not in METHODS]
+    if unknown:
+        raise ValueError(f"Неизвестные методы: {', '.join(map(str, unknown))} "
+                         f"(доступны: {', '.join(METHODS)})")
+
+
+def check_rates(rates):
+    """
+    Проверка значений rate (числа или строки): ValueError со списком неверных,
+    иначе список чисел из (0, 1]
+    """
+    result, invalid = [], []
+    for rate in rates:
+        try:
+            value = float(rate)
+        except (TypeError, ValueError):
+            value = None
+        if value is None or not 0 < value <= 1:
+            invalid.append(rate)
+        result.append(value)
+    if invalid:
+        raise ValueError(f"Неверные значения rate: {', '.join(map(str, invalid))} (нужно 0 < rate <= 1)")
+    return result
+
+
+def output_name(cover, method, rate, output_dir):
+    """
+    Имя выходного файла в том же формате, что и в main.py
+    """
+    container_name = os.path.splitext(os.path.basename(cover))[0]
+    if METHODS[method][2]:
+        name = f"{container_name}_{method}_{rate}.bmp"
+    else:
+        name = f"{container_name}_{method}.bmp"
+    return os.path.join(output_dir, name)
+
+
+def collect_jobs(covers, payload, methods, rates, output_dir):
+    """
+    Формирование заданий по каталогу (или списку) контейнеров
+
+    :param covers: каталог с BMP-файлами или список путей к ним
+    :param payload: файл сообщения (один на все контейнеры) или каталог,
+                    в котором сообщение ищется по имени контейнера без расширения
+    :param methods: список методов
+    :param rates: список значений rate (для Хэмминга не используется)
+    :param output_dir: каталог для результатов
+    """
+    check_methods(methods)
+    if isinstance(covers, str):
+        covers = sorted(
+            os.path.join(covers, name) for name in os.listdir(covers)
+            if name.lower().endswith('.bmp')
+        )
+
+    payloads = {}
+    if os.path.isdir(payload):
+        for name in os.listdir(payload):
+            payloads[os.path.splitext(name)[0]] = os.path.join(payload, name)
+
+    jobs = []
+    for cover in covers:
+        if payloads:
+            job_payload = payloads.get(os.path.splitext(os.path.basename(cover))[0])
+            if job_payload is None:
+                continue
+        else:
+            job_payload = payload
+
+        for method in methods:
+            for rate in (rates if METHODS[method][2] else [None]):
+                jobs.append({
+                    'cover': cover,
+                    'payload': job_payload,
+                    'method': method,
+                    'rate': rate,
+                    'output': output_name(cover, method, rate, output_dir),
+                })
+    return jobs
+
+
+def load_manifest(path):
+    """
+    Чтение манифеста: JSON-список заданий с полями cover, payload, method,
+    а также необязательными rate (по умолчанию 1.0) и output
+    """
+    with open(path, encoding='utf-8') as f:
+        jobs = json.load(f)
+
+    if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+        raise ValueError("Манифест должен быть JSON-списком заданий")
+    for i, job in enumerate(jobs):
+        missing = [name for name in ('cover', 'payload') if not job.get(name)]
+        if missing:
+            raise ValueError(f"Задание {i}: нет обязательных полей: {', '.join(missing)}")
+
+    output_dir = os.path.dirname(os.path.abspath(path))
+    check_methods([job.get('method') for job in jobs])
+    for job in jobs:
+        if METHODS[job['method']][2]:
+            job['rate'], = check_rates([job.get('rate', 1.0)])
+        else:
+            job['rate'] = None
+        if not job.get('output'):
+            job['output'] = output_name(job['cover'], job['method'], job['rate'], output_dir)
+    return jobs
+
+
+def run_job(job, verify=True):
+    """
+    Выполнение одного задания; возвращает словарь с итогами (ошибки не выбрасываются)
+    """
+    global _COVERS
+
+    result = dict(job)
+    start = time.perf_counter()
+    try:
+        if _COVERS is None:
+            from cache import CoverCache
+            _COVERS = CoverCache()
+        cls = load_method(job['method'])
+        args = (job['rate'],) if METHODS[job['method']][2] else ()
+
+        with open(job['payload'], 'rb') as f:
+            message = f.read()
+        result['payload_bytes'] = len(message)
+
+        collector = MetricsCollector(keep_events=False)
+        # Результат проверяется в памяти, без повторного чтения выходного файла
+        stego = cls(job['cover'], metrics=collector, cache=_COVERS).embed(message, None, *args)
+        with open(job['output'], 'wb') as f:
+            f.write(stego)
+        if verify:
+            result['verified'] = cls(stego, metrics=collector).extract(*args) == message
+        result['metrics'] = collector.summary()
+        result['ok'] = True
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = str(e)
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def run_batch(jobs, workers=None, verify=True):
+    """
+    Выполнение заданий в пуле процессов; результаты выдаются по мере готовности
+    (при workers=1 всё выполняется в текущем процессе)
+    """
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield run_job(job, verify)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job, verify) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
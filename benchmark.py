@@ -0,0 +1,192 @@
+"""
+Воспроизводимый замер скорости embed/extract для LSBR_BMP, LSBM_BMP и HammingStego.
+
+Покрывающие изображения (24-битные BMP) генерируются локально из зерна, каждый
+случай выполняется в отдельном процессе, чтобы пиковый RSS относился только к нему.
+Результаты пишутся в JSON; с --baseline прогон сравнивается с предыдущим и
+завершается с кодом 1, если медианная задержка выросла больше чем на --threshold.
+
+Пример:
+    python benchmark.py --sizes 256x256,1024x1024 --output bench.json
+    python benchmark.py --baseline bench.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import struct
+import platform
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from instrumentation import percentiles
+
+DEFAULT_SIZES = '256x256,512x512,1024x1024,1920x1080,3840x2160,7680x4320'
+DEFAULT_METHODS = 'lsbr,lsbm,hamming'
+DEFAULT_RATES = '1,0.5,0.25,0.2'
+DEFAULT_FILLS = '0.1,0.5,0.9'
+
+
+def make_cover(output_file, width, height, seed=0):
+    """
+    Синтетический 24-битный BMP со случайными пикселями
+    """
+    import numpy as np
+
+    row_bytes = width * 3
+    stride = (row_bytes + 3) // 4 * 4
+    rng = np.random.default_rng(seed)
+
+    with open(output_file, 'wb') as f:
+        f.write(b'BM' + struct.pack('<IHHI', 54 + stride * height, 0, 0, 54))
+        f.write(struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0, stride * height, 2835, 2835, 0, 0))
+        # Пишем по строкам, чтобы не держать 8K-изображение в памяти целиком
+        padding = bytes(stride - row_bytes)
+        for _ in range(height):
+            f.write(rng.integers(0, 256, row_bytes, dtype=np.uint8).tobytes() + padding)
+
+
+def capacity(cls, cover, method, rate):
+    """
+    Максимальная длина сообщения (в байтах) для метода и rate
+    """
+    obj = cls(cover, use_mmap=True)
+    try:
+        return obj.capacity() if method == 'hamming' else obj.capacity(rate)
+    finally:
+        obj.close()
+
+
+def run_case(case):
+    """
+    Один случай (метод, размер, rate, заполнение); выполняется в отдельном процессе
+    """
+    import resource
+    import numpy as np
+    from batch import load_method
+
+    cls = load_method(case['method'])
+    rate = case['rate']
+    args = (rate,) if rate is not None else ()
+
+    payload_bytes = int(capacity(cls, case['cover'], case['method'], rate) * case['fill'])
+    message = np.random.default_rng(case['seed']).integers(0, 256, payload_bytes, dtype=np.uint8).tobytes()
+    output = os.path.join(case['workdir'], f"stego_{os.getpid()}.bmp")
+
+    embed_times, extract_times = [], []
+    for _ in range(case['repeat']):
+        obj = cls(case['cover'])
+        kwargs = {'seed': case['seed']} if case['method'] == 'lsbm' else {}
+        start = time.perf_counter()
+        obj.embed(message, output, *args, **kwargs)
+        embed_times.append(time.perf_counter() - start)
+
+        obj = cls(output)
+        start = time.perf_counter()
+        extracted = obj.extract(*args)
+        extract_times.append(time.perf_counter() - start)
+        if extracted != message:
+            raise RuntimeError(f"Извлечённое сообщение не совпадает: {case}")
+    os.remove(output)
+
+    cover_bytes = os.path.getsize(case['cover'])
+    result = {key: case[key] for key in ('method', 'width', 'height', 'rate', 'fill')}
+    result.update(payload_bytes=payload_bytes, cover_bytes=cover_bytes)
+    for name, times in (('embed', embed_times), ('extract', extract_times)):
+        stats = percentiles(times)
+        stats['cover_mb_s'] = cover_bytes / stats['p50'] / 1e6
+        stats['payload_mb_s'] = payload_bytes / stats['p50'] / 1e6
+        result[name] = stats
+    # ru_maxrss в Linux - в килобайтах
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def case_key(result):
+    return (result['method'], result['width'], result['height'], result['rate'], result['fill'])
+
+
+def compare(results, baseline, threshold):
+    """
+    Сравнение медианных задержек с базовым прогоном; возвращает список регрессий
+    """
+    previous = {case_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        for name in ('embed', 'extract'):
+            ratio = result[name]['p50'] / old[name]['p50']
+            if ratio > 1 + threshold:
+                regressions.append({'case': case_key(result), 'phase': name, 'ratio': round(ratio, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер скорости методов встраивания")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="размеры через запятую, например 256x256,7680x4320")
+    parser.add_argument('--methods', default=DEFAULT_METHODS)
+    parser.add_argument('--rates', default=DEFAULT_RATES, help="rate для LSB-R и LSB-M")
+    parser.add_argument('--fills', default=DEFAULT_FILLS, help="доля ёмкости, занимаемая сообщением")
+    parser.add_argument('--repeat', type=int, default=5, help="число повторов каждого вызова")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', help="JSON предыдущего прогона для сравнения")
+    parser.add_argument('--threshold', type=float, default=0.2, help="допустимый рост медианной задержки")
+    args = parser.parse_args(argv)
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    methods = args.methods.split(',')
+    rates = [float(r) for r in args.rates.split(',')]
+    fills = [float(f) for f in args.fills.split(',')]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Новый процесс на каждый случай: пиковый RSS не накапливается между случаями
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, max_tasks_per_child=1) as pool:
+            for width, height in sizes:
+                cover = os.path.join(workdir, f"cover_{width}x{height}.bmp")
+                make_cover(cover, width, height, args.seed)
+                for method in methods:
+                    for rate in (rates if method != 'hamming' else [None]):
+                        for fill in fills:
+                            case = {
+                                'method': method, 'width': width, 'height': height,
+                                'rate': rate, 'fill': fill, 'cover': cover,
+                                'repeat': args.repeat, 'seed': args.seed, 'workdir': workdir,
+                            }
+                            result = pool.submit(run_case, case).result()
+                            results.append(result)
+                            print(f"{method:8} {width}x{height} rate={rate} fill={fill}: "
+                                  f"embed p50 {result['embed']['p50'] * 1e3:.2f} ms, "
+                                  f"extract p50 {result['extract']['p50'] * 1e3:.2f} ms", file=sys.stderr)
+                os.remove(cover)
+
+    import numpy as np
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['regressions'] = compare(results, json.load(f), args.threshold)
+        exit_code = 1 if report['regressions'] else 0
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
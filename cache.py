@@ -0,0 +1,156 @@
+"""
+Кэш покрывающих изображений для повторных внедрений в один и тот же контейнер.
+
+Файл читается и разбирается один раз; производные данные (плоскость LSB,
+синдромы блоков кода Хемминга) вычисляются по запросу и тоже хранятся в кэше.
+Каждое внедрение получает свою копию-при-записи (copy-on-write): контейнер
+ссылается на неизменяемые байты из кэша и копирует их только перед первой
+записью в носители, поэтому один объект метода можно использовать многократно.
+
+Ключ записи - путь, время изменения и размер файла (или хэш содержимого для
+изображений в памяти и при by_hash=True). Суммарный объём ограничен max_bytes,
+при превышении вытесняются давно не использованные записи (LRU).
+
+Пример:
+    covers = CoverCache(max_bytes=512 << 20)
+    hamming = HammingStego('life.bmp', cache=covers)
+    for message in messages:
+        stego = hamming.embed(message)
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from BMPContainer import BMPContainer
+
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+def _nbytes(value):
+    return getattr(value, 'nbytes', 0)
+
+
+class CachedCover:
+    """
+    Запись кэша: неизменяемые байты файла, разобранный заголовок и производные данные
+    """
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        # Контейнер только для чтения: take() возвращает представления без копирования
+        self.container = BMPContainer(data)
+        self.image_size = self.container.image_size
+        self.nbytes = len(data)
+        self._derived = {}
+        self._lock = threading.Lock()
+        self._owner = None
+
+    def checkout(self):
+        """
+        Рабочий контейнер для одного внедрения: байты копируются только перед первой записью
+        """
+        return BMPContainer(self.data)
+
+    def derive(self, name, compute):
+        """
+        Производные данные контейнера (вычисляются один раз функцией compute())
+
+        :param name: ключ, например ('syndromes', k)
+        """
+        with self._lock:
+            if name in self._derived:
+                return self._derived[name]
+        value = compute()
+        with self._lock:
+            value = self._derived.setdefault(name, value)
+            self.nbytes = len(self.data) + sum(_nbytes(v) for v in self._derived.values())
+        if self._owner is not None:
+            self._owner._evict()
+        return value
+
+    def lsb_plane(self):
+        """
+        Младшие биты всех носителей (uint8, по байту на носитель)
+        """
+        return self.derive('lsb', lambda: self.container.take() & 1)
+
+
+class CoverCache:
+    """
+    LRU-кэш покрывающих изображений с ограничением объёма
+
+    :param max_bytes: предельный суммарный объём записей (байты файлов и производные данные)
+    :param by_hash: ключ по хэшу содержимого, а не по пути и времени изменения
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, by_hash=False):
+        self.max_bytes = max_bytes
+        self.by_hash = by_hash
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, source, data=None):
+        if data is not None:
+            return ('hash', hashlib.blake2b(data, digest_size=16).digest())
+        st = os.stat(source)
+        return ('path', os.path.realpath(source), st.st_mtime_ns, st.st_size)
+
+    def get(self, source):
+        """
+        Запись кэша для изображения: путь, файлоподобный объект (читается целиком
+        с текущей позиции) или bytes-like объект
+        """
+        data = None
+        if hasattr(source, 'read'):
+            data = bytes(source.read())
+        elif not isinstance(source, (str, os.PathLike)):
+            data = bytes(source)
+        elif self.by_hash:
+            with open(source, 'rb') as f:
+                data = f.read()
+        key = self._key(source, data)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        if data is None:
+            with open(source, 'rb') as f:
+                data = f.read()
+        entry = CachedCover(key, data)
+
+        with self._lock:
+            entry = self._entries.setdefault(key, entry)
+            self._entries.move_to_end(key)
+        entry._owner = self
+        self._evict()
+        return entry
+
+    def _evict(self):
+        """
+        Вытеснение давно не использованных записей при превышении max_bytes
+        (последняя использованная запись остаётся, даже если больше предела)
+        """
+        with self._lock:
+            total = sum(entry.nbytes for entry in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, entry = self._entries.popitem(last=False)
+                entry._owner = None
+                total -= entry.nbytes
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
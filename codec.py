@@ -0,0 +1,167 @@
+"""
+Сжатие сообщения перед внедрением.
+
+Сообщение сжимается одним из стандартных алгоритмов (zlib, lzma, bz2); в режиме
+'auto' пробуются все (для коротких - только zlib) и выбирается самый короткий
+результат, а если сжатие не уменьшает сообщение, оно внедряется как есть.
+Алгоритм записывается во флаги кадра (frame.py), поэтому extract распаковывает
+сообщение без подсказок. Длина распакованного сообщения ограничена
+(output_limit), так что подобранный файл не распакуется в гигабайты.
+
+Форматы без собственных заголовков и контрольных сумм (raw deflate, raw LZMA2):
+целостность и так проверяется CRC32 в кадре.
+"""
+import bz2
+import lzma
+import zlib
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_BZ2 = 3
+
+CODECS = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'lzma': CODEC_LZMA, 'bz2': CODEC_BZ2}
+
+# Алгоритм хранится в битах 4-5 флагов кадра
+_FLAGS_SHIFT = 4
+_FLAGS_MASK = 0x3 << _FLAGS_SHIFT
+
+# Распаковка - с фильтром preset 9 (словарь 64 МБ подходит для любого меньшего),
+# сжатие - с preset 6: preset 9 тратит ~40 мс только на подготовку словаря
+_LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 9}]
+_LZMA_COMPRESS_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6}]
+
+# Короткие сообщения в режиме 'auto' сжимаются только zlib: lzma и bz2 на них
+# не выигрывают у deflate, но заметно медленнее
+AUTO_ZLIB_ONLY = 4096
+
+# Наибольшая степень сжатия, допустимая при распаковке (для deflate - теоретический предел):
+# без ограничения подобранное сообщение с верной CRC распаковывается в гигабайты
+MAX_RATIO = {CODEC_ZLIB: 1032, CODEC_LZMA: 8192, CODEC_BZ2: 1 << 20}
+
+# Наибольшая длина распакованного сообщения
+MAX_OUTPUT = 256 * 1024 * 1024
+
+
+def output_limit(codec, length):
+    """
+    Наибольшая длина распакованного сообщения из length байтов, сжатого алгоритмом codec
+    """
+    return min(length * MAX_RATIO.get(codec, 1), MAX_OUTPUT)
+
+
+def _compress(codec, data):
+    if codec == CODEC_ZLIB:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    if codec == CODEC_LZMA:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_COMPRESS_FILTERS)
+    if codec == CODEC_BZ2:
+        return bz2.compress(data, 9)
+    return bytes(data)
+
+
+def compress(message, codec='auto'):
+    """
+    Сжатие сообщения
+
+    :param message: байты сообщения
+    :param codec: 'auto' (самый короткий из zlib, lzma, bz2; для сообщений короче
+                  AUTO_ZLIB_ONLY - только zlib), имя алгоритма
+                  или None/False/'none' - без сжатия
+    :return: (данные для внедрения, номер алгоритма)
+    """
+    if not codec or codec == 'none':
+        return message, CODEC_NONE
+    if codec == 'auto':
+        candidates = [CODEC_ZLIB] if len(message) < AUTO_ZLIB_ONLY else [CODEC_ZLIB, CODEC_LZMA, CODEC_BZ2]
+    elif codec in CODECS:
+        candidates = [CODECS[codec]]
+    else:
+        raise ValueError(f"Неизвестный алгоритм сжатия: {codec}")
+
+    best, best_codec = message, CODEC_NONE
+    for candidate in candidates:
+        data = _compress(candidate, message)
+        # Результат, который extract не распакует из-за ограничения длины, не годится
+        if len(data) < len(best) and len(message) <= output_limit(candidate, len(data)):
+            best, best_codec = data, candidate
+    return best, best_codec
+
+
+class _Decompressor:
+    """
+    Потоковая распаковка с ограничением общей длины результата
+    """
+    def __init__(self, codec, max_length):
+        self.codec = codec
+        self.max_length = max_length
+        self.total = 0
+        if codec == CODEC_ZLIB:
+            self._obj = zlib.decompressobj(-15)
+        elif codec == CODEC_LZMA:
+            self._obj = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+        elif codec == CODEC_BZ2:
+            self._obj = bz2.BZ2Decompressor()
+        else:
+            self._obj = None
+
+    def decompress(self, data):
+        # Просим на байт больше остатка: получив его, знаем, что предел превышен
+        limit = self.max_length - self.total + 1
+        try:
+            if self._obj is None:
+                chunk = bytes(data)
+            elif self.codec == CODEC_ZLIB:
+                chunk = self._obj.decompress(data, limit)
+            else:
+                chunk = self._obj.decompress(data, max_length=limit)
+        except (zlib.error, lzma.LZMAError, OSError, EOFError) as e:
+            raise ValueError(f"Не удалось распаковать сообщение: {e}")
+        self.total += len(chunk)
+        if self.total > self.max_length:
+            raise ValueError("Распакованное сообщение превышает допустимую длину")
+        return chunk
+
+    @property
+    def eof(self):
+        return self._obj is None or self._obj.eof
+
+
+def decompress(data, codec, max_length=None):
+    """
+    Распаковка извлечённого сообщения
+
+    :param max_length: наибольшая длина результата (по умолчанию - output_limit(codec, len(data)))
+    """
+    if codec == CODEC_NONE:
+        return data
+    if max_length is None:
+        max_length = output_limit(codec, len(data))
+    obj = decompressor(codec, max_length)
+    message = obj.decompress(data)
+    if not obj.eof:
+        raise ValueError("Не удалось распаковать сообщение: данные обрываются")
+    return message
+
+
+def decompressor(codec, max_length=MAX_OUTPUT):
+    """
+    Объект с методом decompress(data) для потоковой распаковки; ValueError,
+    если общая длина результата превышает max_length
+    """
+    return _Decompressor(codec, max_length)
+
+
+def to_flags(codec):
+    """
+    Флаги кадра для алгоритма codec
+    """
+    return codec << _FLAGS_SHIFT
+
+
+def from_flags(flags):
+    """
+    Алгоритм сжатия по флагам кадра
+    """
+    return (flags & _FLAGS_MASK) >> _FLAGS_SHIFT
@@ -0,0 +1,217 @@
+"""
+Самоописывающий заголовок (кадр) внедрённого сообщения.
+
+Кадр занимает FRAME_SIZE байтов и записывается в LSB первых FRAME_BITS носителей
+подряд, независимо от метода и rate, поэтому извлечение начинается с чтения
+этих носителей: по ним сразу видно, есть ли в файле сообщение, каким методом
+и с какими параметрами оно внедрено, какой оно длины.
+
+Формат (big-endian):
+    0-1   MAGIC (b'SG')
+    2     версия формата
+    3     метод (METHOD_LSBR, METHOD_LSBM, METHOD_HAMMING)
+    4     флаги: FLAG_KEYED - носители выбраны выборкой по ключу (keyed.py)
+          биты 4-5 - алгоритм сжатия сообщения (codec.py)
+    5-6   параметр метода: шаг step для LSB (с FLAG_KEYED - rate в единицах 1/65535),
+          k для кода Хемминга
+    7-10  длина сообщения в байтах (после сжатия)
+    11-14 CRC32 сообщения (после сжатия)
+    15    младший байт CRC32 байтов 0-14 (проверка самого кадра)
+"""
+import math
+import struct
+import zlib
+from collections import namedtuple
+import numpy as np
+
+MAGIC = b'SG'
+VERSION = 1
+
+METHOD_LSBR = 1
+METHOD_LSBM = 2
+METHOD_HAMMING = 3
+
+# Идентификатор метода в кадре -> имя метода (как в batch.METHODS)
+METHOD_NAMES = {METHOD_LSBR: 'lsbr', METHOD_LSBM: 'lsbm', METHOD_HAMMING: 'hamming'}
+
+FLAG_KEYED = 0x01
+
+FRAME_SIZE = 16
+FRAME_BITS = FRAME_SIZE * 8
+
+_FRAME_STRUCT = struct.Struct('>2sBBBHII')
+
+Frame = namedtuple('Frame', 'method param flags length crc')
+
+
+def payload_offset(unit_bytes):
+    """
+    Номер носителя, с которого начинается сообщение: область кадра округляется
+    до целого числа единиц внедрения (шагов step или блоков кода)
+    """
+    return -(-FRAME_BITS // unit_bytes) * unit_bytes
+
+
+def lsb_step(rate):
+    """
+    Шаг между носителями LSB-R и LSB-M для доли пикселей rate
+    """
+    return math.ceil(1 / rate) if rate < 1.0 else 1
+
+
+def lsb_capacity(image_size, rate=1.0, key=None):
+    """
+    Максимальная длина сообщения (в байтах) для LSB-R и LSB-M с заданным rate
+    (с ключом - точная, floor(N * rate) носителей, см. keyed.py);
+    -1, если в изображении не помещается даже область кадра
+    """
+    if key is not None:
+        import keyed
+        return keyed.capacity(image_size, rate)
+    step = lsb_step(rate)
+    if image_size < payload_offset(step):
+        return -1
+    return -(-(image_size - payload_offset(step)) // step) // 8
+
+
+def pack_frame(method, param, length, crc, flags=0):
+    """
+    Кадр в виде массива из FRAME_BITS битов
+    """
+    if not 0 <= param <= 0xFFFF:
+        raise ValueError("Параметр метода не помещается в заголовок")
+    if not 0 <= length <= 0xFFFFFFFF:
+        raise ValueError("Сообщение слишком большое")
+
+    header = _FRAME_STRUCT.pack(MAGIC, VERSION, method, flags, param, length, crc)
+    header += bytes([zlib.crc32(header) & 0xFF])
+    return np.unpackbits(np.frombuffer(header, dtype=np.uint8))
+
+
+def read_frame(container):
+    """
+    Чтение кадра из LSB первых FRAME_BITS носителей контейнера
+
+    :return: Frame или None, если кадра нет (файл не содержит сообщения
+             или внедрён в старом формате)
+    """
+    carriers = container.take(0, FRAME_BITS)
+    if len(carriers) < FRAME_BITS:
+        return None
+
+    header = np.packbits(carriers & 1).tobytes()
+    if header[:2] != MAGIC or header[15] != zlib.crc32(header[:15]) & 0xFF:
+        return None
+
+    magic, version, method, flags, param, length, crc = _FRAME_STRUCT.unpack(header[:15])
+    if version != VERSION or method not in METHOD_NAMES:
+        return None
+    return Frame(method, param, flags, length, crc)
+
+
+def check_payload(frame, message):
+    """
+    Проверка CRC извлечённого сообщения
+    """
+    if len(message) != frame.length or zlib.crc32(message) != frame.crc:
+        raise ValueError("Контрольная сумма сообщения не совпадает: данные повреждены")
+
+
+def unpack_payload(frame, message_bits):
+    """
+    Байты сообщения из извлечённых битов: по кадру проверяется CRC и сообщение
+    распаковывается (frame=None - старый формат, биты возвращаются как есть)
+    """
+    import codec
+
+    message = np.packbits(message_bits).tobytes()
+    if frame is not None:
+        check_payload(frame, message)
+        message = codec.decompress(message, codec.from_flags(frame.flags))
+    return message
+
+
+def read_lsb(container, rate=None, key=None):
+    """
+    Биты сообщения, внедрённого LSB-R или LSB-M: параметры берутся из кадра
+    (с ключом или с шагом step); если кадра нет, при заданном rate сообщение
+    читается в старом формате, иначе сообщения нет
+
+    :return: (кадр или None, биты, число прочитанных носителей)
+    """
+    header = read_frame(container)
+    if header is not None:
+        if header.method not in (METHOD_LSBR, METHOD_LSBM):
+            raise ValueError("Сообщение внедрено другим методом")
+        if header.flags & FLAG_KEYED:
+            import keyed
+            return (header, *keyed.extract_lsb(container, key, header))
+        return (header, *extract_lsb(container, header.param, header.length))
+    if rate is not None:
+        return (None, *extract_lsb_legacy(container, lsb_step(rate)))
+    return None, np.zeros(0, dtype=np.uint8), FRAME_BITS
+
+
+def lsb_fits(image_size, step, length):
+    """
+    Помещается ли сообщение длины length, внедрённое после кадра с шагом step
+    """
+    return step >= 1 and (not length or payload_offset(step) + (length * 8 - 1) * step < image_size)
+
+
+def read_legacy_length(container, step):
+    """
+    Длина сообщения старого формата LSB-R/LSB-M (32 бита с шагом step);
+    None, если носителей не хватает
+    """
+    carriers = container.take(0, 32 * step, step)
+    if len(carriers) < 32:
+        return None
+    return int.from_bytes(np.packbits(carriers & 1).tobytes(), 'big')
+
+
+def legacy_lsb_fits(image_size, step, length):
+    """
+    Помещается ли сообщение старого формата длины length с шагом step
+    """
+    return (32 + length * 8 - 1) * step < image_size
+
+
+def extract_lsb(container, step, length):
+    """
+    Биты сообщения, внедрённого LSB-R или LSB-M после кадра с шагом step
+
+    :return: (биты, число прочитанных носителей)
+    """
+    offset = payload_offset(step)
+    total_bits = length * 8
+
+    # Сообщение, не помещающееся в контейнер, означает повреждённый кадр
+    if not lsb_fits(container.image_size, step, length):
+        raise ValueError("Длина сообщения в заголовке превышает ёмкость изображения")
+
+    # Читаем только нужные носители, а не всё изображение
+    message_bits = container.take(offset, offset + total_bits * step, step) & 1
+    return message_bits, FRAME_BITS + total_bits
+
+
+def extract_lsb_legacy(container, step):
+    """
+    Биты сообщения в старом формате без кадра: 4 байта длины и сообщение
+    в носителях с шагом step
+
+    :return: (биты, число прочитанных носителей)
+    """
+    # Сначала извлекаем длину сообщения (первые 32 бита)
+    message_length = read_legacy_length(container, step)
+
+    # Если не удалось извлечь длину сообщения
+    if message_length is None:
+        return np.zeros(0, dtype=np.uint8), -(-container.image_size // step)
+
+    max_bits = 32 + message_length * 8
+
+    # Извлекаем само сообщение: читаем только нужные носители, а не всё изображение
+    message_bits = container.take(32 * step, max_bits * step, step) & 1
+    message_bits = message_bits[:len(message_bits) // 8 * 8]
+    return message_bits, 32 + len(message_bits)
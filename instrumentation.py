@@ -0,0 +1,133 @@
+"""
+Замеры работы методов встраивания: время по фазам (load, pack, embed/extract,
+write), число затронутых носителей, внедрённых и реально изменённых битов и
+эффективность встраивания (битов сообщения на одно изменение).
+
+Классы методов принимают параметр metrics: функцию metrics(event) или объект
+MetricsCollector. По окончании каждой операции ему передаётся словарь event.
+При metrics=None используется заглушка DISABLED, и замеры ничего не стоят.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Instrument:
+    """
+    Замеры одной операции (load, embed, extract) одного метода
+    """
+    enabled = True
+
+    def __init__(self, sink, method, operation):
+        self.sink = sink
+        self.event = {'method': method, 'operation': operation, 'phases': {}}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Замер времени фазы (повторные замеры одной фазы суммируются)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = self.event['phases']
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, **values):
+        """
+        Запись счётчиков (carriers_touched, bits_embedded, bits_flipped и т.п.)
+        """
+        self.event.update(values)
+
+    def finish(self):
+        """
+        Завершение операции и передача события получателю
+        """
+        event = self.event
+        event['total'] = time.perf_counter() - self._start
+        if event.get('bits_embedded') is not None and event.get('bits_flipped') is not None:
+            event['efficiency'] = event['bits_embedded'] / event['bits_flipped'] if event['bits_flipped'] else None
+        self.sink(event)
+
+
+def percentiles(samples):
+    """
+    Сводка по задержкам (в секундах)
+    """
+    samples = sorted(samples)
+
+    def pick(q):
+        return samples[min(int(round(q * (len(samples) - 1))), len(samples) - 1)]
+    return {
+        'mean': sum(samples) / len(samples),
+        'p50': pick(0.5),
+        'p90': pick(0.9),
+        'p99': pick(0.99),
+        'min': samples[0],
+        'max': samples[-1],
+    }
+
+
+class _DisabledInstrument:
+    """
+    Заглушка на случай, когда замеры отключены
+    """
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_CONTEXT
+
+    def count(self, **values):
+        pass
+
+    def finish(self):
+        pass
+
+
+DISABLED = _DisabledInstrument()
+
+
+def instrument(sink, method, operation):
+    """
+    Замеры операции для получателя sink (None - замеры отключены)
+    """
+    if sink is None:
+        return DISABLED
+    return Instrument(sink, method, operation)
+
+
+class MetricsCollector:
+    """
+    Накопитель событий: хранит все события и сводку по (method, operation)
+    """
+    def __init__(self, keep_events=True):
+        self.keep_events = keep_events
+        self.events = []
+        self.totals = {}
+
+    def __call__(self, event):
+        if self.keep_events:
+            self.events.append(event)
+
+        totals = self.totals.setdefault((event['method'], event['operation']), {'calls': 0, 'phases': {}})
+        totals['calls'] += 1
+        for name, seconds in event['phases'].items():
+            totals['phases'][name] = totals['phases'].get(name, 0.0) + seconds
+        for key in ('total', 'carriers_touched', 'bits_embedded', 'bits_flipped'):
+            if event.get(key) is not None:
+                totals[key] = totals.get(key, 0) + event[key]
+
+    def summary(self):
+        """
+        Сводка: суммарное время по фазам и средняя эффективность встраивания
+        """
+        result = {}
+        for (method, operation), totals in self.totals.items():
+            item = dict(totals)
+            if item.get('bits_flipped'):
+                item['efficiency'] = item['bits_embedded'] / item['bits_flipped']
+            result[f"{method}.{operation}"] = item
+        return result
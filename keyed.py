@@ -0,0 +1,202 @@
+"""
+Выбор носителей для LSB-R и LSB-M псевдослучайной перестановкой по ключу.
+
+Вместо носителей с шагом step = ceil(1/rate) сообщение записывается в первые
+носители перестановки всех носителей после кадра. Изменения равномерно рассеяны
+по изображению, а ёмкость для дробного rate точная: floor(N * rate) носителей,
+а не N / ceil(1/rate).
+
+Перестановка - сеть Фейстеля с раундовыми ключами из SHA-256 ключа и
+"прогулкой по циклу" (значения за пределами N шифруются повторно): i-й носитель
+вычисляется отдельно от остальных, поэтому строятся только первые total_bits
+номеров, а не перестановка всего изображения. Выбранные носители обходятся по
+возрастанию номеров (так буфер читается в несколько раз быстрее, чем вразброс),
+а к битам сообщения прибавляется гамма из генератора, инициализированного ключом:
+без ключа сообщение не читается, даже если выбраны почти все носители.
+Построенные номера хранятся в кэше (LRU до INDEX_CACHE_BYTES байтов) по хэшу
+ключа и размеру изображения; одна
+перестановка обслуживает все rate и длины сообщений: более короткому сообщению
+достаётся её начало, более длинному досчитывается только недостающий хвост.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import frame
+
+# rate хранится в параметре кадра (16 бит) в единицах 1/RATE_SCALE
+RATE_SCALE = 0xFFFF
+
+
+def rate_param(rate):
+    """
+    rate в единицах 1/RATE_SCALE для параметра кадра
+    """
+    if not 0 < rate <= 1:
+        raise ValueError("rate должен быть в диапазоне (0, 1]")
+    return max(1, min(RATE_SCALE, round(rate * RATE_SCALE)))
+
+
+def carrier_count(image_size, param):
+    """
+    Число носителей сообщения для изображения из image_size носителей и параметра кадра param
+    """
+    return max(image_size - frame.FRAME_BITS, 0) * param // RATE_SCALE
+
+
+def capacity(image_size, rate):
+    """
+    Максимальная длина сообщения (в байтах) для заданного rate;
+    -1, если в изображении не помещается даже кадр
+    """
+    if image_size < frame.FRAME_BITS:
+        return -1
+    return carrier_count(image_size, rate_param(rate)) // 8
+
+
+def fits(image_size, param, length):
+    """
+    Помещается ли сообщение длины length в носители, выбранные по ключу с параметром кадра param
+    """
+    return length * 8 <= carrier_count(image_size, param)
+
+
+def _digest(key):
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    elif isinstance(key, int):
+        key = str(key).encode('ascii')
+    return hashlib.sha256(b'carriers:' + bytes(key)).digest()
+
+
+def _permute(x, bits, round_keys):
+    """
+    Перестановка чисел x (массив без знака) на множестве [0, 2^bits): несбалансированная
+    сеть Фейстеля, раунд переносит младшую часть наверх и смешивает её со старшей
+    """
+    dtype = x.dtype.type
+    for r, k in enumerate(round_keys):
+        a = bits // 2 if r % 2 == 0 else bits - bits // 2
+        b = bits - a
+        low = x & dtype((1 << a) - 1)
+        # Раундовая функция: перемешивание младшей части с раундовым ключом
+        f = low * dtype(0x9E3779B1)
+        f += dtype(k)
+        f ^= f >> dtype(15)
+        f *= dtype(0x85EBCA77)
+        f ^= f >> dtype(13)
+        f &= dtype((1 << b) - 1)
+        x >>= dtype(a)
+        x ^= f
+        low <<= dtype(b)
+        low |= x
+        x = low
+    return x
+
+
+# Перестановка вычисляется кусками такого размера: промежуточные массивы
+# помещаются в кэш процессора, что в несколько раз быстрее обработки целиком
+PERMUTE_CHUNK = 1 << 14
+
+
+def _permute_chunks(x, bits, round_keys):
+    """
+    _permute по кускам из PERMUTE_CHUNK элементов
+    """
+    result = np.empty_like(x)
+    for start in range(0, len(x), PERMUTE_CHUNK):
+        result[start:start + PERMUTE_CHUNK] = _permute(x[start:start + PERMUTE_CHUNK].copy(), bits, round_keys)
+    return result
+
+
+def _compute_indices(round_keys, size, start, stop):
+    """
+    Элементы [start, stop) перестановки чисел [0, size)
+    """
+    bits = max(size - 1, 1).bit_length()
+    dtype = np.uint32 if bits <= 32 else np.uint64
+    x = _permute_chunks(np.arange(start, max(stop, start), dtype=dtype), bits, round_keys)
+    # Значения вне [0, size) шифруются повторно, пока не попадут в диапазон
+    pending = np.flatnonzero(x >= size)
+    while len(pending):
+        x[pending] = _permute_chunks(x[pending], bits, round_keys)
+        pending = pending[x[pending] >= size]
+    return x
+
+
+def _round_keys(digest):
+    return [int.from_bytes(digest[i:i + 4], 'big') for i in range(0, 16, 4)]
+
+
+def _gamma(digest, total_bits):
+    """
+    Гамма для битов сообщения (генератор инициализирован второй половиной хэша ключа)
+    """
+    rng = np.random.default_rng(int.from_bytes(digest[16:], 'big'))
+    return np.unpackbits(np.frombuffer(rng.bytes(-(-total_bits // 8)), dtype=np.uint8))[:total_bits]
+
+
+# Сколько байтов номеров носителей хранить в кэше
+INDEX_CACHE_BYTES = 256 << 20
+
+# (хэш ключа, размер изображения) -> [начало перестановки, число битов, номера по возрастанию]
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def carriers(key, image_size, total_bits):
+    """
+    Носители сообщения из total_bits битов: множество из первых total_bits элементов
+    перестановки носителей после кадра (номера по возрастанию, массив только для
+    чтения) и гамма, которая прибавляется к битам сообщения по модулю 2
+
+    :param key: ключ (строка, байты, bytearray или целое число)
+    :return: (index, gamma)
+    """
+    size = max(image_size - frame.FRAME_BITS, 0)
+    if total_bits > size:
+        raise ValueError("Сообщение слишком большое для изображения")
+
+    digest = _digest(key)
+    cache_key = (digest, image_size)
+    with _cache_lock:
+        entry = _cache.get(cache_key)
+        if entry is not None:
+            _cache.move_to_end(cache_key)
+    if entry is not None and entry[1] == total_bits:
+        return entry[2], _gamma(digest, total_bits)
+
+    prefix = entry[0] if entry is not None else np.zeros(0, dtype=np.uint32)
+    if len(prefix) < total_bits:
+        tail = _compute_indices(_round_keys(digest), size, len(prefix), total_bits)
+        prefix = np.concatenate([prefix, tail]) if len(prefix) else tail
+        prefix.setflags(write=False)
+
+    index = np.sort(prefix[:total_bits])
+    index += index.dtype.type(frame.FRAME_BITS)
+    index.setflags(write=False)
+
+    with _cache_lock:
+        _cache[cache_key] = [prefix, total_bits, index]
+        _cache.move_to_end(cache_key)
+        # Вытесняем давно не использованные перестановки (последнюю оставляем всегда)
+        while len(_cache) > 1 and sum(v[0].nbytes + v[2].nbytes for v in _cache.values()) > INDEX_CACHE_BYTES:
+            _cache.popitem(last=False)
+    return index, _gamma(digest, total_bits)
+
+
+def extract_lsb(container, key, header):
+    """
+    Биты сообщения, внедрённого LSB-R или LSB-M по ключу
+
+    :return: (биты, число прочитанных носителей)
+    """
+    if key is None:
+        raise ValueError("Сообщение внедрено с ключом: для извлечения нужен key")
+
+    total_bits = header.length * 8
+    if not fits(container.image_size, header.param, header.length):
+        raise ValueError("Длина сообщения в заголовке превышает ёмкость изображения")
+
+    index, gamma = carriers(key, container.image_size, total_bits)
+    return (container.take_index(index) & 1) ^ gamma, frame.FRAME_BITS + total_bits
@@ -1,13 +1,22 @@
-from LSBR_BMP import LSBR_BMP
-from LSBM_BMP import LSBM_BMP
-from HammingStego import HammingStego
-# from test import LSBR_BMP
-# from test2 import LSBM_BMP
-# from test3 import HammingStego
-import tkinter as tk
-from tkinter import filedialog
+import sys
+import argparse
+
+def save_image(image, output_file):
+    """
+    Запись изображения, полученного из embed в памяти, в файл
+    """
+    with open(output_file, 'wb') as f:
+        f.write(image)
 
 def main():
+    # Тяжёлые модули (tkinter, NumPy) загружаются только в интерактивном режиме
+    from LSBR_BMP import LSBR_BMP
+    from LSBM_BMP import LSBM_BMP
+    from HammingStego import HammingStego
+    from cache import CoverCache
+    import tkinter as tk
+    from tkinter import filedialog
+
     try:
         root = tk.Tk()
         root.withdraw() # Скрыть основное окно
@@ -30,42 +39,104 @@ def main():
         container_name = input_file.split('/')[-1].split('.')[0]
         # Внедрение сообщения LSB-R
         rate = float(input("Укажите rate внедрения для LSB-R и LSB-M: "))
+        # Контейнер читается с диска один раз для всех трёх методов
+        covers = CoverCache()
         # input_file = "life.bmp"
         output_file = f"{container_name}_lsbr_{rate}.bmp"
         secret_message = input('Введите скрываемый текст: ')
-        lsb = LSBR_BMP(input_file)
-        lsb.embed(secret_message, output_file, rate)
+        lsb = LSBR_BMP(input_file, cache=covers)
+        stego = lsb.embed(secret_message, None, rate)
+        save_image(stego, output_file)
         print("\nСкрываемое методом LSB-R сообщение внедрено в изображение: ", output_file)
         
-        # Извлечение сообщения
-        lsbr_stego = LSBR_BMP(output_file)
+        # Извлечение сообщения (из памяти, без повторного чтения файла)
+        lsbr_stego = LSBR_BMP(stego)
         lsbr_extracted_message = lsbr_stego.extract(rate).decode('utf-8')
         print("Извлеченное сообщение для метода LSB-R: ", lsbr_extracted_message, '\n')
 
         # Внедрение сообщения LSB-M
         output_file = f"{container_name}_lsbm_{rate}.bmp"
-        lsbm = LSBM_BMP(input_file)
-        lsbm.embed(secret_message, output_file, rate)
+        lsbm = LSBM_BMP(input_file, cache=covers)
+        stego = lsbm.embed(secret_message, None, rate)
+        save_image(stego, output_file)
         print("Скрываемое методом LSB-M сообщение внедрено в изображение: ", output_file)
         
         # Извлечение сообщения
-        lsbm_stego = LSBM_BMP(output_file)
+        lsbm_stego = LSBM_BMP(stego)
         lsbm_extracted_message = lsbm_stego.extract(rate).decode('utf-8')
         print("Извлеченное сообщение для метода LSB-M: ", lsbm_extracted_message, "\n")
 
         # Внедрение сообщения Хэммингом
         output_file = f"{container_name}_hamming.bmp"
-        hamming = HammingStego(input_file)
-        hamming.embed(secret_message, output_file)
+        hamming = HammingStego(input_file, cache=covers)
+        stego = hamming.embed(secret_message)
+        save_image(stego, output_file)
         print("Скрываемое кодом Хэмминга сообщение внедрено в изображение: ", output_file)
         
         # Извлечение сообщения
-        hamming_stego = HammingStego(output_file)
+        hamming_stego = HammingStego(stego)
         hamming_extracted_message = hamming_stego.extract().decode('utf-8', errors='ignore')
         print("Извлеченное сообщение для кода Хэмминга: ", hamming_extracted_message)
     
     except Exception as e:
         print(f"Произошла ошибка: {str(e)}")
 
+def batch_main(argv):
+    """
+    Неинтерактивный режим: пакетная обработка каталога контейнеров или манифеста
+    """
+    parser = argparse.ArgumentParser(description="Пакетное внедрение сообщений в BMP-контейнеры")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help="JSON-список заданий (cover, payload, method, rate, output)")
+    source.add_argument('--covers', help="каталог с BMP-контейнерами")
+    parser.add_argument('--payload', help="файл сообщения или каталог сообщений (по имени контейнера)")
+    parser.add_argument('--methods', default='lsbr,lsbm,hamming', help="методы через запятую: lsbr, lsbm, hamming")
+    parser.add_argument('--rates', default='1.0', help="значения rate через запятую (для LSB-R и LSB-M)")
+    parser.add_argument('--output-dir', default='.', help="каталог для результатов")
+    parser.add_argument('--workers', type=int, default=None, help="число процессов (по умолчанию - число ядер)")
+    parser.add_argument('--no-verify', action='store_true', help="не проверять извлечение после внедрения")
+    parser.add_argument('--summary', help="файл для итогов (JSON lines), по умолчанию - stdout")
+    args = parser.parse_args(argv)
+
+    import json
+    import os
+    from batch import check_methods, check_rates, collect_jobs, load_manifest, run_batch
+
+    if args.manifest:
+        try:
+            jobs = load_manifest(args.manifest)
+        except ValueError as e:
+            parser.error(f"{args.manifest}: {e}")
+    else:
+        if not args.payload:
+            parser.error("для --covers нужен --payload")
+        methods = [m.strip() for m in args.methods.split(',') if m.strip()]
+        try:
+            check_methods(methods)
+        except ValueError as e:
+            parser.error(f"--methods: {e}")
+        try:
+            rates = check_rates([r.strip() for r in args.rates.split(',') if r.strip()])
+        except ValueError as e:
+            parser.error(f"--rates: {e}")
+        jobs = collect_jobs(args.covers, args.payload, methods, rates, args.output_dir)
+
+    for job in jobs:
+        os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+
+    out = open(args.summary, 'w', encoding='utf-8') if args.summary else sys.stdout
+    failed = 0
+    try:
+        for result in run_batch(jobs, args.workers, verify=not args.no_verify):
+            failed += not result['ok'] or result.get('verified') is False
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
     main()
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+Быстрый поиск BMP-файлов, содержащих внедрённое сообщение.
+
+Каждый файл отображается в память (mmap), и читаются только заголовок и первые
+носители: кадр (frame.py) и, для файлов старого формата, 32-битная длина
+сообщения - так же, как её читают LSBR_BMP.extract, LSBM_BMP.extract (для
+каждого rate из списка) и HammingStego.extract. Длина считается правдоподобной,
+если сообщение такой длины помещается в контейнер. Файлы обрабатываются в пуле
+процессов, результаты выдаются в виде JSON lines по мере готовности.
+
+Пример:
+    python scanner.py corpus/ --rates 1,0.5,0.25 --workers 8 --output found.jsonl
+"""
+import os
+import sys
+import json
+import argparse
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_RATES = '1,0.5,0.25'
+
+# Сколько файлов отдавать процессу за один раз: время на файл мало, и пересылка
+# по одному стоила бы больше, чем само сканирование
+SCAN_CHUNK = 64
+
+def iter_bmp_files(paths):
+    """
+    BMP-файлы из списка путей (каталоги обходятся рекурсивно)
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.bmp'):
+                    yield os.path.join(root, name)
+
+
+def legacy_lsb_candidates(container, rates):
+    """
+    Длина сообщения старого формата LSB-R/LSB-M (32 бита с шагом step) для каждого rate
+    """
+    import frame
+
+    candidates = []
+    for rate in rates:
+        step = frame.lsb_step(rate)
+        length = frame.read_legacy_length(container, step)
+        # Нулевая длина - это просто нулевые LSB, а не сообщение
+        if length and frame.legacy_lsb_fits(container.image_size, step, length):
+            candidates.append({'method': 'lsb', 'rate': rate, 'length': length})
+    return candidates
+
+
+def legacy_hamming_candidates(container):
+    """
+    Длина сообщения и k старого формата HammingStego (32 бита, закодированные k = 4)
+    """
+    import HammingStego
+
+    header = HammingStego.read_legacy_header(container)
+    if header is None:
+        return []
+    k, length = header
+    if not length or not HammingStego.legacy_fits(container.image_size, k, length):
+        return []
+    return [{'method': 'hamming', 'k': k, 'length': length}]
+
+
+def _frame_fits(header, image_size):
+    """
+    Помещается ли сообщение, описанное кадром, в контейнер
+    """
+    import frame
+
+    if header.method == frame.METHOD_HAMMING:
+        import HammingStego
+        return HammingStego.fits(image_size, header.param, header.length)
+    if header.flags & frame.FLAG_KEYED:
+        import keyed
+        return keyed.fits(image_size, header.param, header.length)
+    return frame.lsb_fits(image_size, header.param, header.length)
+
+
+def scan_file(path, rates=(1.0,)):
+    """
+    Проверка одного файла; возвращает словарь с итогами (ошибки не выбрасываются)
+
+    :param path: путь к BMP-файлу
+    :param rates: значения rate, для которых проверяется старый формат LSB-R/LSB-M
+    :return: {'path', 'payload', 'frame', 'candidates'} или {'path', 'payload', 'error'}
+    """
+    import frame
+    from BMPContainer import BMPContainer
+
+    result = {'path': path, 'payload': False}
+    try:
+        # mmap: с диска читаются только страницы заголовка и первых носителей
+        container = BMPContainer(path, use_mmap=True)
+    except (OSError, ValueError) as e:
+        result['error'] = str(e)
+        return result
+
+    try:
+        header = frame.read_frame(container)
+        if header is not None:
+            result['frame'] = {
+                'method': frame.METHOD_NAMES[header.method],
+                'param': header.param,
+                'length': header.length,
+                'crc': header.crc,
+                'fits': _frame_fits(header, container.image_size),
+            }
+            result['payload'] = result['frame']['fits']
+        else:
+            result['frame'] = None
+            result['candidates'] = legacy_lsb_candidates(container, rates) + legacy_hamming_candidates(container)
+            result['payload'] = bool(result['candidates'])
+    except ValueError as e:
+        result['error'] = str(e)
+    finally:
+        container.close()
+    return result
+
+
+def _scan_many(paths, rates):
+    return [scan_file(path, rates) for path in paths]
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan(paths, rates=(1.0,), workers=None):
+    """
+    Сканирование файлов и каталогов; результаты выдаются по мере готовности
+    (при workers=1 всё выполняется в текущем процессе)
+
+    :param paths: список файлов и каталогов
+    :param rates: значения rate для старого формата LSB-R/LSB-M
+    :param workers: число процессов (None - по числу ядер)
+    """
+    files = iter_bmp_files(paths)
+    if workers == 1:
+        for path in files:
+            yield scan_file(path, rates)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(_scan_many, _chunks(files, SCAN_CHUNK), repeat(tuple(rates))):
+            yield from results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Поиск BMP-файлов с внедрёнными сообщениями")
+    parser.add_argument('paths', nargs='+', help="файлы и каталоги (обходятся рекурсивно)")
+    parser.add_argument('--rates', default=DEFAULT_RATES, help="значения rate для старого формата LSB-R и LSB-M")
+    parser.add_argument('--workers', type=int, default=None, help="число процессов (по умолчанию - число ядер)")
+    parser.add_argument('--all', action='store_true', help="выводить и файлы без сообщения")
+    parser.add_argument('--output', help="файл для результатов (JSON lines), по умолчанию - stdout")
+    args = parser.parse_args(argv)
+
+    rates = [float(r) for r in args.rates.split(',') if r.strip()]
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for result in scan(args.paths, rates, args.workers):
+            if args.all or result['payload'] or 'error' in result:
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
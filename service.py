@@ -0,0 +1,425 @@
+"""
+Локальный сервис внедрения и извлечения сообщений (asyncio, HTTP/1.1 через
+Unix-сокет или localhost).
+
+Запросы:
+    POST /embed?method=lsbr&rate=0.5    тело: контейнер, затем сообщение;
+                                        длина контейнера - в заголовке X-Cover-Length;
+                                        ответ - BMP со встроенным сообщением
+    POST /extract?method=lsbr           тело: BMP; ответ - извлечённое сообщение
+    GET  /stats                         счётчики, задержки и пропускная способность (JSON)
+
+Вычисления выполняются в ограниченном пуле процессов. Если в очереди больше
+max_pending запросов, новые сразу отклоняются с кодом 503 (клиент повторяет позже),
+запрос, не уложившийся в timeout секунд, завершается с кодом 504.
+
+Пример:
+    python service.py --socket /tmp/stego.sock --workers 4
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_MAX_PENDING = 64
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_BODY = 256 << 20
+# Сколько последних задержек хранить для перцентилей
+LATENCY_WINDOW = 1024
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 500: 'Internal Server Error',
+    503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _method_args(method, params):
+    """
+    Класс метода и аргументы embed/extract из параметров запроса
+    """
+    from batch import METHODS, load_method
+
+    cls = load_method(method)
+    if METHODS[method][2]:
+        args = (float(params.get('rate', 1.0)),)
+    else:
+        args = ()
+    return cls, args
+
+
+def embed_job(method, cover, message, params):
+    """
+    Внедрение в процессе пула: контейнер и результат передаются в памяти
+    """
+    cls, args = _method_args(method, params)
+    kwargs = {}
+    if method == 'hamming' and params.get('k'):
+        kwargs['k'] = int(params['k'])
+    if method == 'lsbm' and params.get('seed'):
+        kwargs['seed'] = int(params['seed'])
+    if params.get('compress'):
+        kwargs['compress'] = params['compress']
+    # bytearray используется контейнером без копирования
+    return bytes(cls(bytearray(cover)).embed(message, None, *args, **kwargs))
+
+
+def extract_job(method, image, params):
+    """
+    Извлечение в процессе пула
+    """
+    cls, args = _method_args(method, params)
+    # Для старого формата без кадра нужен rate, переданный явно
+    args = args if 'rate' in params else ()
+    return cls(image).extract(*args)
+
+
+class Stats:
+    """
+    Счётчики запросов по конечным точкам
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.endpoints = {}
+        self.in_flight = 0
+        self.pending = 0
+
+    def record(self, endpoint, status, seconds, bytes_in, bytes_out):
+        item = self.endpoints.setdefault(endpoint, {
+            'requests': 0, 'ok': 0, 'errors': 0, 'rejected': 0, 'timeouts': 0,
+            'bytes_in': 0, 'bytes_out': 0, 'latencies': deque(maxlen=LATENCY_WINDOW),
+        })
+        item['requests'] += 1
+        item['bytes_in'] += bytes_in
+        item['bytes_out'] += bytes_out
+        if status == 200:
+            item['ok'] += 1
+            item['latencies'].append(seconds)
+        elif status == 503:
+            item['rejected'] += 1
+        elif status == 504:
+            item['timeouts'] += 1
+        else:
+            item['errors'] += 1
+
+    def snapshot(self):
+        from instrumentation import percentiles
+
+        uptime = time.monotonic() - self.started
+        endpoints = {}
+        for name, item in self.endpoints.items():
+            result = {key: value for key, value in item.items() if key != 'latencies'}
+            result['requests_per_s'] = item['ok'] / uptime if uptime else 0.0
+            result['bytes_in_per_s'] = item['bytes_in'] / uptime if uptime else 0.0
+            if item['latencies']:
+                result['latency'] = percentiles(item['latencies'])
+            endpoints[name] = result
+        return {
+            'uptime': uptime,
+            'in_flight': self.in_flight,
+            'pending': self.pending,
+            'endpoints': endpoints,
+        }
+
+
+class StegoService:
+    """
+    HTTP-сервис поверх asyncio; вычисления выполняются в пуле процессов
+
+    :param workers: число процессов (None - по числу ядер)
+    :param max_pending: сколько запросов может ждать и выполняться одновременно
+    :param timeout: предельное время обработки запроса в секундах
+    :param max_body: максимальный размер тела запроса в байтах
+    """
+    def __init__(self, workers=None, max_pending=DEFAULT_MAX_PENDING, timeout=DEFAULT_TIMEOUT,
+                 max_body=DEFAULT_MAX_BODY):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_body = max_body
+        self.stats = Stats()
+        self.pool = None
+        self.server = None
+        self._slots = None
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """
+        Запуск сервиса на Unix-сокете path или на host:port (port=0 - любой свободный)
+        """
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        # Не больше workers задач в пуле: остальные ждут здесь, а не в очереди пула
+        self._slots = asyncio.Semaphore(self.workers)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    async def _handle(self, reader, writer):
+        """
+        Обработка соединения (несколько запросов подряд при keep-alive)
+        """
+        try:
+            while True:
+                request = await self._read_request(reader, writer)
+                if request is None:
+                    break
+                keep_alive = await self._dispatch(*request, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            verb, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            await self._respond(writer, 400, {'error': "Некорректная строка запроса"}, False)
+            return None
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._respond(writer, 400, {'error': "Некорректный заголовок Content-Length"}, False)
+            return None
+        if length > self.max_body:
+            await self._respond(writer, 413, {'error': "Слишком большое тело запроса"}, False)
+            return None
+        body = await reader.readexactly(length) if length else b''
+        return verb, target, headers, body
+
+    async def _dispatch(self, verb, target, headers, body, writer):
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        endpoint = url.path.strip('/')
+        start = time.perf_counter()
+
+        try:
+            if endpoint == 'stats':
+                if verb != 'GET':
+                    raise HTTPError(405, "Ожидается GET")
+                await self._respond(writer, 200, self.stats.snapshot(), keep_alive)
+                return keep_alive
+            if endpoint not in ('embed', 'extract'):
+                raise HTTPError(404, f"Неизвестный путь: {url.path}")
+            if verb != 'POST':
+                raise HTTPError(405, "Ожидается POST")
+            result = await self._run(endpoint, params, headers, body)
+            status, payload = 200, result
+        except HTTPError as e:
+            status, payload = e.status, {'error': str(e)}
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+
+        if endpoint in ('embed', 'extract'):
+            self.stats.record(endpoint, status, time.perf_counter() - start, len(body),
+                              len(payload) if status == 200 else 0)
+        await self._respond(writer, status, payload, keep_alive)
+        return keep_alive
+
+    async def _run(self, endpoint, params, headers, body):
+        """
+        Выполнение запроса в пуле с ограничением очереди и временем ожидания
+        """
+        method = params.get('method')
+        if method not in ('lsbr', 'lsbm', 'hamming'):
+            raise HTTPError(400, f"Неизвестный метод: {method}")
+
+        if endpoint == 'embed':
+            cover_length = int(headers.get('x-cover-length', -1))
+            if not 0 <= cover_length <= len(body):
+                raise HTTPError(400, "Нужен заголовок X-Cover-Length с длиной контейнера")
+            job = (embed_job, method, body[:cover_length], body[cover_length:], params)
+        else:
+            job = (extract_job, method, body, params)
+
+        # Обратное давление: переполненная очередь сразу отвечает 503
+        if self.stats.pending >= self.max_pending:
+            raise HTTPError(503, "Очередь запросов переполнена")
+
+        self.stats.pending += 1
+        try:
+            return await asyncio.wait_for(self._submit(job), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f"Запрос не выполнен за {self.timeout} с")
+        finally:
+            self.stats.pending -= 1
+
+    async def _submit(self, job):
+        """
+        Ожидание свободного слота и выполнение задачи в пуле
+        """
+        await self._slots.acquire()
+        # Слот освобождается, только когда задача действительно завершится в пуле:
+        # задача, начатая в процессе пула, по таймауту не прерывается, и иначе
+        # повторные таймауты отправляли бы в пул больше workers задач
+        future = asyncio.get_running_loop().run_in_executor(self.pool, *job)
+        self.stats.in_flight += 1
+        future.add_done_callback(self._job_done)
+        return await asyncio.shield(future)
+
+    def _job_done(self, future):
+        self.stats.in_flight -= 1
+        self._slots.release()
+        if not future.cancelled():
+            # Ошибка задачи, ответ на которую уже не ждут, не должна попадать в журнал asyncio
+            future.exception()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            content_type = 'application/octet-stream'
+        else:
+            payload = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json'
+
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(payload)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        writer.write(payload)
+        await writer.drain()
+
+
+class ServiceClient:
+    """
+    Локальный клиент сервиса (одно соединение на запрос)
+
+    :param path: путь к Unix-сокету (или None)
+    :param host, port: адрес TCP-сервиса, если path не задан
+    """
+    def __init__(self, path=None, host='127.0.0.1', port=None):
+        self.path = path
+        self.host = host
+        self.port = port
+
+    async def request(self, verb, target, body=b'', headers=None):
+        """
+        Отправка запроса; возвращает (статус, тело ответа)
+        """
+        if self.path is not None:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            head = [f"{verb} {target} HTTP/1.1", "Host: localhost",
+                    f"Content-Length: {len(body)}", "Connection: close"]
+            head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            return status, await reader.readexactly(length)
+        finally:
+            writer.close()
+
+    async def _call(self, target, body, headers=None):
+        status, data = await self.request('POST', target, body, headers)
+        if status != 200:
+            raise HTTPError(status, json.loads(data).get('error', ''))
+        return data
+
+    async def embed(self, method, cover, message, **params):
+        """
+        Внедрение message в cover; возвращает BMP со встроенным сообщением
+        """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        query = '&'.join(f"{key}={value}" for key, value in {'method': method, **params}.items())
+        return await self._call(f"/embed?{query}", bytes(cover) + bytes(message),
+                                {'X-Cover-Length': len(cover)})
+
+    async def extract(self, method, image, **params):
+        """
+        Извлечение сообщения из BMP
+        """
+        query = '&'.join(f"{key}={value}" for key, value in {'method': method, **params}.items())
+        return await self._call(f"/extract?{query}", bytes(image))
+
+    async def stats(self):
+        status, data = await self.request('GET', '/stats')
+        return json.loads(data)
+
+
+async def serve(args):
+    service = StegoService(args.workers, args.max_pending, args.timeout, args.max_body)
+    await service.start(args.socket, args.host, args.port)
+    print(f"Сервис запущен: {args.socket or service.address}", file=sys.stderr)
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный сервис внедрения и извлечения сообщений")
+    parser.add_argument('--socket', help="путь к Unix-сокету (по умолчанию - TCP на --host:--port)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help="число процессов (по умолчанию - число ядер)")
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help="предел очереди запросов, сверх него - ответ 503")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="время на запрос в секундах")
+    parser.add_argument('--max-body', type=int, default=DEFAULT_MAX_BODY, help="максимальный размер запроса в байтах")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Внедрение одного сообщения в несколько контейнеров.
+
+Сообщение делится на части по ёмкости каждого контейнера для выбранного метода
+(и rate), части внедряются параллельно в пуле процессов. Каждая часть
+начинается с заголовка последовательности: идентификатор сообщения, номер
+части, число частей, смещение части в сообщении, общая длина и CRC32 всего
+сообщения. Поэтому стего-файлы можно передавать для извлечения в любом
+порядке: они читаются параллельно, а сообщение выдаётся кусками по мере того,
+как становятся доступны очередные части.
+
+Пример:
+    python sharding.py embed --covers covers/ --payload archive.bin --method hamming --output-dir out/
+    python sharding.py extract out/*.bmp --output archive.bin
+"""
+import os
+import sys
+import zlib
+import struct
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SHARD_MAGIC = b'SQ'
+# MAGIC, идентификатор сообщения, номер части, число частей, алгоритм сжатия,
+# смещение части, общая длина и CRC32 сообщения (после сжатия)
+_SHARD_STRUCT = struct.Struct('>2s8sIIBQQI')
+SHARD_HEADER_SIZE = _SHARD_STRUCT.size
+
+Shard = namedtuple('Shard', 'payload_id index count codec offset total_length crc')
+
+
+def pack_shard_header(shard):
+    return _SHARD_STRUCT.pack(SHARD_MAGIC, *shard)
+
+
+def unpack_shard_header(data):
+    """
+    Заголовок последовательности в начале извлечённой части
+    """
+    if len(data) < SHARD_HEADER_SIZE or data[:2] != SHARD_MAGIC:
+        raise ValueError("Файл не содержит части составного сообщения")
+    return Shard(*_SHARD_STRUCT.unpack_from(data)[1:])
+
+
+def _method_args(method, rate, key):
+    """
+    Позиционные и именованные аргументы embed/capacity для метода
+    """
+    from batch import METHODS
+
+    if not METHODS[method][2]:
+        return (), {}
+    return (rate,), ({'key': key} if key is not None else {})
+
+
+def cover_capacity(cover, method, rate=1.0, key=None):
+    """
+    Сколько байтов сообщения (без заголовка части) помещается в контейнер
+    """
+    from batch import load_method
+
+    obj = load_method(method)(cover, use_mmap=True)
+    try:
+        args, kwargs = _method_args(method, rate, key)
+        return max(obj.capacity(*args, **kwargs) - SHARD_HEADER_SIZE, 0)
+    finally:
+        obj.close()
+
+
+def plan_shards(payload_length, capacities):
+    """
+    Распределение сообщения по контейнерам по порядку: каждый заполняется
+    до своей ёмкости
+
+    :return: список (номер контейнера, смещение, длина); пустое сообщение -
+             одна часть нулевой длины в первом контейнере
+    """
+    if not capacities:
+        raise ValueError("Не переданы контейнеры")
+    if payload_length == 0:
+        return [(0, 0, 0)]
+
+    plan = []
+    offset = 0
+    for i, capacity in enumerate(capacities):
+        if offset >= payload_length:
+            break
+        if capacity <= 0:
+            continue
+        length = min(capacity, payload_length - offset)
+        plan.append((i, offset, length))
+        offset += length
+    if offset < payload_length or not plan:
+        raise ValueError(f"Сообщение слишком большое для набора контейнеров. "
+                         f"Нужно {payload_length} байт, доступно {sum(max(c, 0) for c in capacities)}")
+    return plan
+
+
+def _embed_shard(job):
+    """
+    Внедрение одной части (выполняется в процессе пула)
+    """
+    from batch import load_method
+
+    args, kwargs = _method_args(job['method'], job['rate'], job['key'])
+    load_method(job['method'])(job['cover']).embed(job['data'], job['output'], *args, **kwargs)
+    return {key: job[key] for key in ('cover', 'output', 'index')} | {'bytes': len(job['data'])}
+
+
+def embed_shards(payload, covers, output_dir, method='lsbr', rate=1.0, key=None,
+                 compress=None, workers=None):
+    """
+    Внедрение сообщения частями в набор контейнеров
+
+    :param payload: строка или байты
+    :param covers: список путей к контейнерам (используются по порядку, лишние не трогаются)
+    :param output_dir: каталог для стего-файлов <контейнер>_<метод>_part<номер>.bmp
+    :param method: 'lsbr', 'lsbm' или 'hamming'
+    :param rate: доля носителей для LSB-R и LSB-M
+    :param key: ключ выбора носителей для LSB-R и LSB-M
+    :param compress: сжать всё сообщение перед делением (см. codec.compress)
+    :param workers: число процессов (None - по числу ядер)
+    :return: список частей (cover, output, index, bytes) в порядке номеров
+    """
+    import codec
+
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    payload, codec_id = codec.compress(bytes(payload), compress)
+
+    capacities = [cover_capacity(cover, method, rate, key) for cover in covers]
+    plan = plan_shards(len(payload), capacities)
+
+    payload_id = os.urandom(8)
+    crc = zlib.crc32(payload)
+    jobs = []
+    for index, (i, offset, length) in enumerate(plan):
+        header = Shard(payload_id, index, len(plan), codec_id, offset, len(payload), crc)
+        name = os.path.splitext(os.path.basename(covers[i]))[0]
+        jobs.append({
+            'cover': covers[i],
+            'output': os.path.join(output_dir, f"{name}_{method}_part{index}.bmp"),
+            'index': index,
+            'method': method,
+            'rate': rate,
+            'key': key,
+            'data': pack_shard_header(header) + payload[offset:offset + length],
+        })
+
+    if workers == 1 or len(jobs) == 1:
+        return [_embed_shard(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_embed_shard, jobs))
+
+
+def _extract_shard(path, key=None):
+    """
+    Извлечение одной части (выполняется в процессе пула): метод берётся из кадра
+    """
+    import frame
+    from batch import load_method
+    from BMPContainer import BMPContainer
+
+    # Метод - по кадру (mmap: читаются только первые носители), затем файл
+    # открывается один раз классом нужного метода
+    container = BMPContainer(path, use_mmap=True)
+    try:
+        header = frame.read_frame(container)
+    finally:
+        container.close()
+    if header is None:
+        raise ValueError(f"{path}: файл не содержит сообщения")
+    method = frame.METHOD_NAMES[header.method]
+
+    obj = load_method(method)(path, use_mmap=True)
+    try:
+        data = obj.extract(key=key) if method != 'hamming' else obj.extract()
+    finally:
+        obj.close()
+
+    shard = unpack_shard_header(data)
+    return shard, data[SHARD_HEADER_SIZE:]
+
+
+def iter_extract_shards(paths, key=None, workers=None):
+    """
+    Извлечение сообщения из частей в любом порядке; сообщение выдаётся кусками
+    по мере готовности очередных частей
+
+    :param paths: стего-файлы со всеми частями сообщения
+    :param key: ключ, если части внедрены с ключом
+    :param workers: число процессов (None - по числу ядер; 1 - в текущем процессе)
+    """
+    import codec
+
+    if not paths:
+        raise ValueError("Не переданы файлы с частями сообщения")
+
+    if workers == 1 or len(paths) == 1:
+        results = (_extract_shard(path, key) for path in paths)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = (future.result() for future in as_completed([pool.submit(_extract_shard, path, key) for path in paths]))
+
+    try:
+        first = None
+        pending = {}
+        next_index = next_offset = 0
+        crc = 0
+        decompressor = None
+
+        for shard, data in results:
+            if first is None:
+                first = shard
+                decompressor = codec.decompressor(shard.codec, codec.output_limit(shard.codec, shard.total_length))
+            elif (shard.payload_id, shard.count, shard.total_length, shard.crc) != \
+                    (first.payload_id, first.count, first.total_length, first.crc):
+                raise ValueError("Части относятся к разным сообщениям")
+            if shard.index in pending or shard.index < next_index or shard.index >= shard.count:
+                raise ValueError(f"Повторная или неверная часть {shard.index}")
+            pending[shard.index] = (shard, data)
+
+            # Выдаём все части, идущие подряд за уже выданными
+            while next_index in pending:
+                shard, data = pending.pop(next_index)
+                if shard.offset != next_offset:
+                    raise ValueError(f"Часть {next_index} не совпадает по смещению")
+                crc = zlib.crc32(data, crc)
+                next_offset += len(data)
+                next_index += 1
+                chunk = decompressor.decompress(data)
+                if chunk:
+                    yield chunk
+
+        if first is None or next_index != first.count:
+            missing = sorted(set(range(first.count if first else 0)) - set(range(next_index)) - set(pending))
+            raise ValueError(f"Не хватает частей сообщения: {missing}")
+        if next_offset != first.total_length or crc != first.crc or not decompressor.eof:
+            raise ValueError("Контрольная сумма сообщения не совпадает: данные повреждены")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def extract_shards(paths, key=None, workers=None):
+    """
+    Извлечение всего сообщения из частей (см. iter_extract_shards)
+    """
+    return b''.join(iter_extract_shards(paths, key, workers))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Внедрение сообщения частями в несколько контейнеров")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    embed = commands.add_parser('embed', help="разделить сообщение и внедрить части")
+    embed.add_argument('--covers', nargs='+', required=True, help="контейнеры или каталог с ними")
+    embed.add_argument('--payload', required=True, help="файл сообщения")
+    embed.add_argument('--method', default='lsbr', choices=('lsbr', 'lsbm', 'hamming'))
+    embed.add_argument('--rate', type=float, default=1.0, help="rate для LSB-R и LSB-M")
+    embed.add_argument('--key', help="ключ выбора носителей для LSB-R и LSB-M")
+    embed.add_argument('--compress', help="auto, zlib, lzma или bz2")
+    embed.add_argument('--output-dir', default='.')
+    embed.add_argument('--workers', type=int, default=None)
+
+    extract = commands.add_parser('extract', help="собрать сообщение из стего-файлов")
+    extract.add_argument('files', nargs='+', help="стего-файлы в любом порядке")
+    extract.add_argument('--key', help="ключ, если части внедрены с ключом")
+    extract.add_argument('--output', help="файл для сообщения (по умолчанию - stdout)")
+    extract.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'embed':
+        covers = args.covers
+        if len(covers) == 1 and os.path.isdir(covers[0]):
+            covers = sorted(os.path.join(covers[0], name) for name in os.listdir(covers[0])
+                            if name.lower().endswith('.bmp'))
+        with open(args.payload, 'rb') as f:
+            payload = f.read()
+        os.makedirs(args.output_dir, exist_ok=True)
+        for part in embed_shards(payload, covers, args.output_dir, args.method, args.rate,
+                                 args.key, args.compress, args.workers):
+            print(f"{part['index']}: {part['output']} ({part['bytes']} байт)", file=sys.stderr)
+        return 0
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_extract_shards(args.files, args.key, args.workers):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import math
+import zlib
+from contextlib import nullcontext
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 1 << 22  # 4 МБ пиксельных данных за один проход
+
+
+def _read_chunks(f, size):
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class PayloadBits:
+    """
+    Поток битов сообщения из произвольного источника: строка, байты,
+    файлоподобный объект (с методом read) или итерируемый объект с кусками байтов
+    """
+    def __init__(self, source, read_size=1 << 16):
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._chunks = iter([bytes(source)])
+        elif hasattr(source, 'read'):
+            self._chunks = _read_chunks(source, read_size)
+        else:
+            self._chunks = iter(source)
+
+        self._pending = np.zeros(0, dtype=np.uint8)
+        self.length = 0  # Сколько байтов сообщения прочитано из источника
+        self.crc = 0  # CRC32 прочитанных байтов
+
+    def take(self, n):
+        """
+        Следующие n битов сообщения (меньше, если источник исчерпан)
+        """
+        parts = [self._pending]
+        have = len(self._pending)
+        while have < n:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+            self.length += len(chunk)
+            self.crc = zlib.crc32(chunk, self.crc)
+            bits = np.unpackbits(np.frombuffer(chunk, dtype=np.uint8))
+            parts.append(bits)
+            have += len(bits)
+
+        bits = np.concatenate(parts)
+        self._pending = bits[n:]
+        return bits[:n]
+
+    def exhausted(self):
+        """
+        Проверка, что в источнике не осталось битов
+        """
+        bits = self.take(1)
+        self._pending = np.concatenate([bits, self._pending])
+        return len(bits) == 0
+
+
+def stream_embed(container, output_file, source, unit_bytes, unit_bits, max_units,
+                 embed_units, header_bytes, embed_header, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Потоковое внедрение сообщения: контейнер читается кусками из целых строк,
+    каждый кусок обрабатывается и сразу записывается в выходной файл
+
+    :param container: BMPContainer с разобранным заголовком покрывающего файла
+    :param output_file: путь или файлоподобный объект с методами write, seek и tell
+    :param source: сообщение (см. PayloadBits), его длина заранее может быть неизвестна
+    :param unit_bytes: сколько байтов пикселей занимает одна единица внедрения
+                       (шаг step для LSB, размер блока для кода Хемминга)
+    :param unit_bits: сколько битов сообщения несёт одна единица
+    :param max_units: сколько единиц доступно в контейнере после области кадра
+    :param embed_units: функция embed_units(pixels, bits), встраивающая bits в первые
+                        единицы куска pixels (куски всегда выровнены по границе единицы)
+    :param header_bytes: сколько первых носителей занимает область кадра (кратно unit_bytes)
+    :param embed_header: функция embed_header(pixels, payload), записывающая кадр
+                         (длину и CRC сообщения из payload) в область кадра pixels
+    :param chunk_size: примерный размер куска в байтах
+    """
+    payload = PayloadBits(source)
+
+    # Длина и CRC сообщения известны только в конце: область кадра заполняем последней
+    if max_units < 0 or header_bytes > container.image_size:
+        raise ValueError("Сообщение слишком большое для изображения")
+
+    # Число строк в куске подбирается так, чтобы число носителей в нём было
+    # кратно unit_bytes, а первый кусок целиком вмещал область кадра
+    row_bytes, stride = container.row_bytes, container.stride
+    rows_step = unit_bytes // math.gcd(row_bytes, unit_bytes) if row_bytes else 1
+    rows = max(chunk_size // (stride * rows_step) if stride else 1, 1) * rows_step
+    if rows * row_bytes < header_bytes:
+        rows = -(-header_bytes // (row_bytes * rows_step)) * rows_step
+
+    units_left = max_units
+
+    is_path = not hasattr(output_file, 'write')
+    try:
+        with container.open() as src, (open(output_file, 'wb') if is_path else nullcontext(output_file)) as dst:
+            start = dst.tell()
+            # Заголовки и палитра копируются как есть
+            dst.write(src.read(container.offset))
+
+            first = None
+            for row in range(0, container.height, rows):
+                raw = bytearray(src.read(min(rows, container.height - row) * stride))
+                view = np.frombuffer(raw, dtype=np.uint8).reshape(-1, stride)[:, :row_bytes]
+                # Плоские носители куска (копия, только если строки выровнены)
+                pixels = view.reshape(-1)
+
+                if first is None:
+                    # Область кадра откладываем до конца, кусок сохраняем
+                    first = (raw, view, pixels)
+                    body = pixels[header_bytes:]
+                else:
+                    body = pixels
+
+                n_units = min(-(-len(body) // unit_bytes), units_left)
+                bits = payload.take(n_units * unit_bits)
+                if len(bits):
+                    embed_units(body, bits)
+                    units_left -= -(-len(bits) // unit_bits)
+                    if not container.contiguous:
+                        view[:] = pixels.reshape(view.shape)
+                dst.write(raw)
+
+                if units_left == 0 and not payload.exhausted():
+                    raise ValueError("Сообщение слишком большое для изображения")
+
+            if not payload.exhausted():
+                raise ValueError("Сообщение слишком большое для изображения")
+
+            # Всё, что лежит после пиксельных данных, копируется как есть
+            for chunk in _read_chunks(src, chunk_size):
+                dst.write(chunk)
+
+            # Теперь длина и CRC известны: дописываем кадр в отложенную область первого куска
+            raw, view, pixels = first
+            embed_header(pixels[:header_bytes], payload)
+            if not container.contiguous:
+                view[:] = pixels.reshape(view.shape)
+            end = dst.tell()
+            dst.seek(start + container.offset)
+            dst.write(raw)
+            dst.seek(end)
+    except ValueError:
+        if is_path:
+            os.remove(output_file)
+        raise